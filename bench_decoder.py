@@ -0,0 +1,56 @@
+import argparse
+import random
+import time
+
+from decoder import DECODERS, encode_position, get_decoder
+
+BOLD = "\033[1m"
+RESET = "\033[0m"
+
+
+def payloads(count, binary=False, seed=0):
+    rng = random.Random(seed)
+    return [encode_position(rng.uniform(-180, 180), rng.uniform(-90, 90), binary) for _ in range(count)]
+
+
+def bench(decode, messages, repeat):
+    """Best-of-`repeat` decode time per message in nanoseconds"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for data in messages:
+            decode(data)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(messages) * 1e9
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare ptzinfo payload decoders")
+    parser.add_argument('--messages', type=int, default=100000, help="payloads per round")
+    parser.add_argument('--repeat', type=int, default=5, help="rounds per decoder, the best is kept")
+    parser.add_argument('decoders', nargs='*', default=list(DECODERS), help="decoders to compare")
+    args = parser.parse_args(argv)
+
+    text = payloads(args.messages)
+    binary = payloads(args.messages, binary=True)
+    baseline = None
+    print(f"{'decoder':<8} {'ns/msg':>9} {'speedup':>8}")
+    for name in args.decoders:
+        try:
+            decode = get_decoder(name)
+        except ImportError as e:
+            print(f"{name:<8} {BOLD}unavailable{RESET} ({e})")
+            continue
+        messages = binary if name == 'binary' else text
+        if decode(messages[0]) is None:
+            raise SystemExit(f"{name} decoded no position from {messages[0]!r}")
+        ns = bench(decode, messages, args.repeat)
+        if name == 'json':
+            baseline = ns
+        speedup = f"{baseline / ns:.1f}x" if baseline else '-'
+        print(f"{name:<8} {ns:>9.0f} {speedup:>8}")
+
+
+if __name__ == "__main__":
+    main()
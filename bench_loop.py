@@ -0,0 +1,130 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from dashboard import Dashboard
+from loopmon import LoopLagMonitor
+from loops import LOOPS, backend_name, run
+from simulator import start_simulation
+from tracker import CameraChannel
+
+BOLD = "\033[1m"
+RESET = "\033[0m"
+
+MAX_ERROR = 0.005
+MIN_DELIVERY = 0.95
+
+
+async def trial(cameras, rate, moves, seed=0, conflate=False):
+    """Time `moves` random moves on each of `cameras` simulated gimbals publishing at `rate` Hz"""
+    cam_ids = list(range(1, cameras + 1))
+    nc, fleet = await start_simulation(cam_ids, rate=rate, seed=seed)
+    dashboard = Dashboard('quiet')
+    channels = [CameraChannel(nc, dashboard, cam_id, conflate=conflate) for cam_id in cam_ids]
+    for channel in channels:
+        await channel.open()
+    await asyncio.sleep(0.2)
+    monitor = LoopLagMonitor().start()
+
+    async def drive(channel):
+        rng = random.Random(seed * 1000 + channel.cam_id)
+        measured = []
+        for _ in range(moves):
+            result = await channel.move(rng.randint(1, 3), round(rng.uniform(-20, 20), 1),
+                                        round(rng.uniform(-10, 10), 1), timeout=10.0)
+            measured.append(result['execution_time'])
+        return measured
+
+    samples = sum(channel.status.samples for channel in channels)
+    start = time.perf_counter()
+    try:
+        results = await asyncio.gather(*(drive(channel) for channel in channels))
+        elapsed = time.perf_counter() - start
+        samples = sum(channel.status.samples for channel in channels) - samples
+    finally:
+        await monitor.stop()
+        for channel in channels:
+            await channel.close()
+        await fleet.stop()
+        await nc.drain()
+
+    errors = 0
+    bias = mae = 0.0
+    for cam_id, measured in zip(cam_ids, results):
+        n, cam_bias, cam_mae = fleet.accuracy(cam_id, measured)
+        errors += n
+        bias += cam_bias * n
+        mae += cam_mae * n
+    lag = monitor.lag
+    return {
+        'cameras': cameras,
+        'rate': rate,
+        'throughput': samples / elapsed,
+        'delivery': samples / elapsed / (cameras * rate),
+        'lag_p50': lag.percentile(0.5),
+        'lag_p99': lag.percentile(0.99),
+        'lag_max': lag.max,
+        'timeouts': sum(measured.count(None) for measured in results),
+        'bias': bias / errors if errors else None,
+        'mae': mae / errors if errors else None,
+    }
+
+
+def _ms(value):
+    return '-' if value is None else f"{value * 1000:.2f}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compare event loop backends on simulated fleets: callback throughput, loop lag "
+                    "and timing error against the simulator's true move times")
+    parser.add_argument('--loops', nargs='+', choices=LOOPS[1:], default=list(LOOPS[1:]),
+                        help="backends to compare")
+    parser.add_argument('--cameras', type=int, nargs='+', default=[1, 4, 16, 32], help="fleet sizes")
+    parser.add_argument('--rates', type=float, nargs='+', default=[20.0, 50.0, 100.0],
+                        help="telemetry rates per camera in Hz")
+    parser.add_argument('--moves', type=int, default=5, help="moves timed per camera in each trial")
+    parser.add_argument('--conflate', action='store_true', help="use conflating subscriptions")
+    parser.add_argument('--max-error', type=float, default=MAX_ERROR,
+                        help="mean absolute timing error in seconds a fleet size must stay within")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help="also write every trial to this JSON file")
+    args = parser.parse_args(argv)
+
+    trials = []
+    print(f"{'loop':<8} {'cams':>5} {'rate':>6} {'msg/s':>9} {'deliv':>6} {'lag p50':>8} {'lag p99':>8} "
+          f"{'lag max':>8} {'bias ms':>8} {'mae ms':>7} {'t/o':>4}")
+    for backend in args.loops:
+        try:
+            name = backend_name(backend)
+        except ImportError as e:
+            print(f"{backend:<8} {BOLD}unavailable{RESET} ({e})")
+            continue
+        for rate in args.rates:
+            for cameras in args.cameras:
+                result = run(trial(cameras, rate, args.moves, args.seed, args.conflate), backend)
+                result['loop'] = name
+                trials.append(result)
+                print(f"{name:<8} {cameras:>5} {rate:>6.0f} {result['throughput']:>9.0f} "
+                      f"{result['delivery']:>6.2f} {_ms(result['lag_p50']):>8} {_ms(result['lag_p99']):>8} "
+                      f"{_ms(result['lag_max']):>8} {_ms(result['bias']):>8} {_ms(result['mae']):>7} "
+                      f"{result['timeouts']:>4}")
+
+    print("=" * 80)
+    for backend in sorted({t['loop'] for t in trials}):
+        for rate in args.rates:
+            accurate = [t['cameras'] for t in trials if t['loop'] == backend and t['rate'] == rate
+                        and t['mae'] is not None and t['mae'] <= args.max_error
+                        and t['delivery'] >= MIN_DELIVERY and not t['timeouts']]
+            best = max(accurate) if accurate else 0
+            print(f"{backend} at {rate:.0f} Hz: up to {BOLD}{best}{RESET} cameras timed within "
+                  f"{args.max_error * 1000:.1f} ms")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(trials, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+import argparse
+import csv
+import os
+
+import numpy as np
+
+from movemodel import ALL_CAMERAS, RESULT_SOURCES, load_samples
+from replay import Recording
+from simulator import TILT_VELOCITY_SCALE, trapezoid_time
+from tracker import MOVE_TIMEOUT, POSITION_TOLERANCE
+
+CALIBRATION_PATH = "calibration.csv"
+CALIBRATION_COLUMNS = ('cam_id', 'axis', 'gimbal_speed', 'dead_time', 'max_velocity', 'acceleration',
+                       'samples', 'rmse')
+AXES = ('pan', 'tilt')
+# Search ranges of the profile parameters, in deg/s and deg/s^2
+VELOCITY_RANGE = (1.0, 400.0)
+ACCEL_RANGE = (1.0, 2000.0)
+GRID = 32
+REFINE_STEPS = 3
+MIN_DISTANCE = 1.0
+MIN_SAMPLES = 3
+
+
+def trapezoid_times(distance, v_max, accel):
+    """Vectorized simulator.trapezoid_time, broadcasting distances against parameter arrays"""
+    distance = np.abs(distance)
+    return np.where(distance <= v_max * v_max / accel, 2 * np.sqrt(distance / accel),
+                    v_max / accel + distance / v_max)
+
+
+def recorded_samples(directory, tolerance=POSITION_TOLERANCE, timeout=MOVE_TIMEOUT):
+    """(cam_id, gimbal_speed, axis, distance, time) columns of every axis movement in a recording
+
+    Each axis is timed on its own, from the command to the first sample
+    within tolerance of its target, so recordings separate the two axes.
+    """
+    recording = Recording(directory)
+    if not len(recording):
+        return [np.empty(0)] * 5
+    heads = recording.starts[:-1]
+    cam_ids = np.array([e['cam_id'] for e in recording.entries], dtype=int)
+    speeds = np.array([int(e['gimbal_speed']) for e in recording.entries], dtype=int)
+    columns = []
+    for axis, (error, times) in enumerate(zip((recording.pan_error, recording.tilt_error),
+                                              recording.axis_times(tolerance, timeout))):
+        distance = error[heads]
+        keep = (distance >= MIN_DISTANCE) & np.isfinite(times)
+        columns.append((cam_ids[keep], speeds[keep], np.full(keep.sum(), axis), distance[keep], times[keep]))
+    return [np.concatenate(parts) for parts in zip(*columns)]
+
+
+def summary_samples(patterns=RESULT_SOURCES):
+    """(cam_id, gimbal_speed, axis, distance, time) columns from results CSVs
+
+    A result only times the slower of the two axes. Each row counts toward
+    the axis expected to finish last, tilt being nominally slower by
+    TILT_VELOCITY_SCALE.
+    """
+    cam_ids, speeds, pan, tilt, seconds = load_samples(patterns)
+    axis = (tilt / TILT_VELOCITY_SCALE > pan).astype(int)
+    distance = np.where(axis == 1, tilt, pan)
+    keep = distance >= MIN_DISTANCE
+    return [cam_ids[keep], speeds[keep], axis[keep], distance[keep], seconds[keep]]
+
+
+def _grid_sse(counts, distance, seconds, v_max, accel):
+    # Per group and candidate: the best dead time is the mean residual, found in closed form
+    residual = seconds[:, None] - trapezoid_times(distance[:, None], v_max, accel)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    s1 = np.add.reduceat(residual, starts, axis=0)
+    s2 = np.add.reduceat(residual * residual, starts, axis=0)
+    dead = np.maximum(s1 / counts[:, None], 0.0)
+    sse = s2 - 2 * dead * s1 + counts[:, None] * dead * dead
+    return dead, sse
+
+
+def fit_profiles(group, distance, seconds, grid=GRID, refine_steps=REFINE_STEPS):
+    """Least-squares (dead time, max velocity, acceleration, rmse) for every group at once
+
+    `group` holds a sorted group index per sample. A log-spaced grid over
+    velocity and acceleration is scored for all groups in one pass, then
+    narrowed around each group's best candidate.
+    """
+    counts = np.bincount(group)
+    v_axis = np.geomspace(*VELOCITY_RANGE, grid)
+    a_axis = np.geomspace(*ACCEL_RANGE, grid)
+    v_grid, a_grid = (g.ravel() for g in np.meshgrid(v_axis, a_axis))
+    v_grid = np.broadcast_to(v_grid, (len(counts), v_grid.size))
+    a_grid = np.broadcast_to(a_grid, (len(counts), a_grid.size))
+    v_span = VELOCITY_RANGE[1] / VELOCITY_RANGE[0]
+    a_span = ACCEL_RANGE[1] / ACCEL_RANGE[0]
+    rows = np.arange(len(counts))
+    for step in range(refine_steps + 1):
+        dead, sse = _grid_sse(counts, distance, seconds, v_grid[group], a_grid[group])
+        best = np.argmin(sse, axis=1)
+        v_best = v_grid[rows, best]
+        a_best = a_grid[rows, best]
+        dead_best = dead[rows, best]
+        sse_best = sse[rows, best]
+        # Next grid: a log-spaced neighbourhood a few cells wide around each group's best
+        v_span = v_span ** (4.0 / grid)
+        a_span = a_span ** (4.0 / grid)
+        offsets = np.linspace(-1.0, 1.0, grid)
+        v_grid, a_grid = (g.reshape(len(counts), -1) for g in np.broadcast_arrays(
+            np.clip(v_best[:, None, None] * v_span ** offsets[None, :, None], *VELOCITY_RANGE),
+            np.clip(a_best[:, None, None] * a_span ** offsets[None, None, :], *ACCEL_RANGE)))
+    rmse = np.sqrt(np.maximum(sse_best, 0.0) / counts)
+    return dead_best, v_best, a_best, rmse
+
+
+class Calibration:
+    """Trapezoidal velocity profile per (camera, axis, gimbal_speed), for closed-form move times"""
+
+    def __init__(self, coefficients=None):
+        # (cam_id or ALL_CAMERAS, axis, gimbal_speed) -> (dead time, max velocity, acceleration, samples, rmse)
+        self.coefficients = coefficients or {}
+
+    @classmethod
+    def fit(cls, cam_ids, speeds, axes, distance, seconds, min_samples=MIN_SAMPLES):
+        keys = [(int(cam), AXES[int(axis)], int(speed)) for cam, axis, speed in zip(cam_ids, axes, speeds)]
+        keys += [(ALL_CAMERAS, axis, speed) for _, axis, speed in keys]
+        distance = np.concatenate([distance, distance])
+        seconds = np.concatenate([seconds, seconds])
+        groups = sorted(set(keys), key=str)
+        index = {key: i for i, key in enumerate(groups)}
+        group = np.array([index[key] for key in keys], dtype=int)
+        counts = np.bincount(group, minlength=len(groups))
+        keep = counts[group] >= min_samples
+        used = [key for key, n in zip(groups, counts) if n >= min_samples]
+        renumber = np.cumsum(counts >= min_samples) - 1
+        order = np.argsort(renumber[group[keep]], kind='stable')
+        coefficients = {}
+        if used:
+            fitted = fit_profiles(renumber[group[keep]][order], distance[keep][order], seconds[keep][order])
+            for key, dead, v_max, accel, rmse in zip(used, *fitted):
+                coefficients[key] = (float(dead), float(v_max), float(accel), int(counts[index[key]]), float(rmse))
+        return cls(coefficients)
+
+    def _fitted(self, cam_id, axis, gimbal_speed):
+        profile = self.coefficients.get((cam_id, axis, gimbal_speed))
+        if profile is None:
+            profile = self.coefficients.get((ALL_CAMERAS, axis, gimbal_speed))
+        return profile
+
+    def axis_profile(self, cam_id, axis, gimbal_speed):
+        """(dead time, max velocity, acceleration, samples, rmse), None if neither axis was fitted at this speed
+
+        An axis without a profile of its own at this speed takes the other
+        axis's, scaled by TILT_VELOCITY_SCALE like the nominal gimbal, with
+        0 samples: results CSVs only time the slower axis, so they rarely
+        fit tilt at more than one speed.
+        """
+        profile = self._fitted(cam_id, axis, gimbal_speed)
+        if profile is not None:
+            return profile
+        other = self._fitted(cam_id, 'pan' if axis == 'tilt' else 'tilt', gimbal_speed)
+        if other is None:
+            return None
+        dead, v_max, accel, _, rmse = other
+        scale = TILT_VELOCITY_SCALE if axis == 'tilt' else 1.0 / TILT_VELOCITY_SCALE
+        return dead, v_max * scale, accel * scale, 0, rmse
+
+    def predict_time(self, cam_id, gimbal_speed, delta_pan, delta_tilt=0.0):
+        """Closed-form move time: the slower axis's dead time plus trapezoid, None for a speed never fitted"""
+        predicted = None
+        for axis, distance in (('pan', delta_pan), ('tilt', delta_tilt)):
+            profile = self.axis_profile(cam_id, axis, gimbal_speed)
+            if profile is None:
+                return None
+            dead, v_max, accel = profile[:3]
+            axis_time = dead + trapezoid_time(distance, v_max, accel)
+            if predicted is None or axis_time > predicted:
+                predicted = axis_time
+        return predicted
+
+    def predict(self, cam_id, gimbal_speed, delta_pan, delta_tilt):
+        # Same signature as MoveTimeEstimator.predict, so it can be used as a prior
+        return self.predict_time(cam_id, gimbal_speed, delta_pan, delta_tilt)
+
+    def profiles(self, cam_id, axis):
+        """{gimbal_speed: (dead time, max velocity, acceleration)} for one camera axis, as SimGimbal takes
+
+        Every speed fitted on either axis is included (see axis_profile).
+        """
+        speeds = {speed for _, _, speed in self.coefficients}
+        return {speed: self.axis_profile(cam_id, axis, speed)[:3] for speed in sorted(speeds)}
+
+    def save(self, path=CALIBRATION_PATH):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', newline='') as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(CALIBRATION_COLUMNS)
+            for (cam_id, axis, speed), (dead, v_max, accel, samples, rmse) in sorted(self.coefficients.items(),
+                                                                                     key=str):
+                writer.writerow([cam_id, axis, speed, round(dead, 4), round(v_max, 3), round(accel, 3),
+                                 samples, round(rmse, 4)])
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=CALIBRATION_PATH):
+        coefficients = {}
+        with open(path, newline='') as csvfile:
+            for row in csv.DictReader(csvfile):
+                cam_id = row['cam_id'] if row['cam_id'] == ALL_CAMERAS else int(row['cam_id'])
+                coefficients[(cam_id, row['axis'], int(row['gimbal_speed']))] = (
+                    float(row['dead_time']), float(row['max_velocity']), float(row['acceleration']),
+                    int(row['samples']), float(row['rmse']))
+        return cls(coefficients)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Fit a trapezoidal velocity profile per camera, axis and gimbal_speed")
+    parser.add_argument('sources', nargs='*', default=None,
+                        help="results CSVs (paths or globs) to fit from, both axes timed together "
+                             "(default: every result file, unless --recordings is given)")
+    parser.add_argument('--recordings', nargs='*', default=[],
+                        help="trajectory directories (see sweep.py --record) to fit each axis from separately")
+    parser.add_argument('--tolerance', type=float, default=POSITION_TOLERANCE,
+                        help="degrees from target at which a recorded axis counts as arrived")
+    parser.add_argument('--min-samples', type=int, default=MIN_SAMPLES,
+                        help="fewest movements a profile is fitted from")
+    parser.add_argument('-o', '--output', default=CALIBRATION_PATH, help="coefficient table to write")
+    args = parser.parse_args(argv)
+
+    parts = [recorded_samples(directory, args.tolerance) for directory in args.recordings]
+    if args.sources or not args.recordings:
+        parts.append(summary_samples(args.sources or RESULT_SOURCES))
+    samples = [np.concatenate(column) for column in zip(*parts)]
+    calibration = Calibration.fit(*samples, min_samples=args.min_samples)
+    calibration.save(args.output)
+
+    print(f"Fitted {len(calibration.coefficients)} profiles from {len(samples[4])} axis movements")
+    print(f"{'camera':>6} {'axis':>5} {'speed':>5} {'dead s':>7} {'v deg/s':>8} {'a deg/s2':>9} {'n':>5} "
+          f"{'rmse s':>7}")
+    for (cam_id, axis, speed), (dead, v_max, accel, n, rmse) in sorted(calibration.coefficients.items(), key=str):
+        print(f"{cam_id:>6} {axis:>5} {speed:>5} {dead:>7.2f} {v_max:>8.1f} {accel:>9.1f} {n:>5} {rmse:>7.2f}")
+    print(f"Coefficients written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+from nats.aio.client import Client as NATS
+from nats.errors import SlowConsumerError
+
+NATS_URL = "nats://localhost:4222"
+
+
+class SlowConsumerStats:
+    """Counts messages the client dropped because a subscription's pending limits were hit"""
+
+    def __init__(self, log=print):
+        # log: where other connection errors are reported, e.g. IOThread.print to keep them off the loop thread
+        self.dropped = {}
+        self.log = log
+
+    async def error_cb(self, e):
+        if isinstance(e, SlowConsumerError):
+            self.dropped[e.subject] = self.dropped.get(e.subject, 0) + 1
+        else:
+            self.log(f"NATS error: {e}")
+
+    def total(self):
+        """Messages dropped over every subject"""
+        return sum(self.dropped.values())
+
+
+async def connect(url=NATS_URL, error_cb=None):
+    """Open the NATS connection shared by every camera in the process"""
+    nc = NATS()
+    if error_cb is None:
+        await nc.connect(url)
+    else:
+        await nc.connect(url, error_cb=error_cb)
+    return nc
@@ -0,0 +1,161 @@
+import asyncio
+import json
+import sys
+import time
+
+MODES = ('live', 'quiet', 'jsonl')
+REFRESH_INTERVAL = 0.1
+
+
+def _finite(value):
+    return None if value != value else value
+
+
+class CameraStatus:
+    """Latest telemetry and progress of one camera, written by the message handler"""
+    __slots__ = ['cam_id', 'total', 'done', 'timeouts', 'errors', 'pan', 'tilt', 'pan_error',
+                 'tilt_error', 'samples', 'rate', 'started', 'predicted_left', 'predicted_at', '_rate_samples',
+                 '_rate_time']
+
+    def __init__(self, cam_id, total=0):
+        self.cam_id = cam_id
+        self.total = total
+        self.done = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.pan = float('nan')
+        self.tilt = float('nan')
+        self.pan_error = float('nan')
+        self.tilt_error = float('nan')
+        self.samples = 0
+        self.rate = 0.0
+        self.started = time.perf_counter()
+        self.predicted_left = None
+        self.predicted_at = self.started
+        self._rate_samples = 0
+        self._rate_time = self.started
+
+    def predict_left(self, seconds, now):
+        """Set the predicted seconds of work left, None to fall back to the average pace"""
+        self.predicted_left = seconds
+        self.predicted_at = now
+
+    def eta(self, now):
+        """Seconds left for this camera's sweep: predicted when known, else at its average pace so far"""
+        if self.predicted_left is not None:
+            return max(self.predicted_left - (now - self.predicted_at), 0.0)
+        if not self.done:
+            return None
+        return (now - self.started) / self.done * (self.total - self.done)
+
+    def _update_rate(self, now):
+        span = now - self._rate_time
+        if span < 0.05:
+            return
+        self.rate = (self.samples - self._rate_samples) / span
+        self._rate_samples = self.samples
+        self._rate_time = now
+
+    def line(self, now):
+        eta = self.eta(now)
+        eta_text = '--:--' if eta is None else f"{int(eta // 60):02d}:{int(eta % 60):02d}"
+        return (f"cam {self.cam_id:>3} | {self.done:>4}/{self.total:<4} | "
+                f"pan {self.pan:8.3f} tilt {self.tilt:8.3f} | "
+                f"err {self.pan_error:7.3f} {self.tilt_error:7.3f} | "
+                f"{self.rate:6.1f} Hz | ETA {eta_text}")
+
+    def as_dict(self, now):
+        return {
+            'type': 'status', 'cam_id': self.cam_id, 'done': self.done, 'total': self.total,
+            'timeouts': self.timeouts, 'errors': self.errors,
+            'pan': _finite(self.pan), 'tilt': _finite(self.tilt),
+            'pan_error': _finite(self.pan_error), 'tilt_error': _finite(self.tilt_error),
+            'rate': round(self.rate, 2), 'eta': self.eta(now),
+        }
+
+
+class Dashboard:
+    """Renders every camera's status at a fixed rate, off the telemetry path
+
+    Message handlers only store numbers in a CameraStatus; formatting and
+    writing happen here, at most once per refresh interval. With an IOThread
+    the formatted text is handed to it and written off the loop thread.
+    """
+
+    def __init__(self, mode='live', interval=REFRESH_INTERVAL, stream=None, io=None):
+        if mode not in MODES:
+            raise ValueError(f"Unknown dashboard mode {mode!r}, expected one of {MODES}")
+        self.mode = mode
+        self.interval = interval
+        self.stream = stream or sys.stdout
+        self.io = io
+        self.cameras = {}
+        self._events = []
+        self._drawn = 0
+        self._task = None
+        self._running = False
+
+    def camera(self, cam_id, total=0):
+        status = self.cameras.get(cam_id)
+        if status is None:
+            status = self.cameras[cam_id] = CameraStatus(cam_id, total)
+        return status
+
+    def event(self, text, **fields):
+        """Queue a one-off message, shown above the status block on the next refresh"""
+        if self.mode == 'jsonl':
+            self._events.append(json.dumps({'type': 'event', 'message': text, **fields}))
+        elif self.mode == 'live':
+            self._events.append(text)
+
+    def start(self):
+        self._running = True
+        if self.mode != 'quiet':
+            self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        """Stop refreshing and leave the final status on screen"""
+        if not self._running:
+            return
+        self._running = False
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self.render()
+        self._drawn = 0
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self.render()
+
+    def render(self):
+        now = time.perf_counter()
+        for status in self.cameras.values():
+            status._update_rate(now)
+        if self.mode == 'quiet':
+            self._events.clear()
+            return
+
+        parts = []
+        if self.mode == 'live':
+            if self._drawn:
+                # Move back to the top of the previous status block and clear it
+                parts.append(f"\033[{self._drawn}F\033[J")
+            parts.extend(event + '\n' for event in self._events)
+            lines = [self.cameras[cam_id].line(now) for cam_id in sorted(self.cameras)]
+            parts.extend(line + '\n' for line in lines)
+            self._drawn = len(lines)
+        else:
+            parts.extend(event + '\n' for event in self._events)
+            parts.extend(json.dumps(self.cameras[cam_id].as_dict(now)) + '\n'
+                         for cam_id in sorted(self.cameras))
+        self._events.clear()
+        if self.io is not None:
+            self.io.submit(self._write, ''.join(parts))
+        else:
+            self._write(''.join(parts))
+
+    def _write(self, text):
+        self.stream.write(text)
+        self.stream.flush()
@@ -0,0 +1,103 @@
+import json
+import re
+import struct
+
+import numpy as np
+
+# json:   json.loads of the whole payload, as the original runners did
+# fast:   pulls the two numbers straight out of the bytes with one compiled
+#         regex, falling back to json for payloads it does not recognise
+# orjson: orjson.loads of the whole payload (optional dependency)
+# binary: two little-endian float64s, pan then tilt, as published by
+#         `simulator.py --encoding binary`
+DECODERS = ('json', 'fast', 'orjson', 'binary')
+DEFAULT_DECODER = 'fast'
+
+BINARY_POSITION = struct.Struct('<dd')
+_POSITION = re.compile(rb'"panposition"\s*:\s*"?([^,}"\s]+)"?\s*,.*?"tiltposition"\s*:\s*"?([^,}"\s]+)', re.S)
+
+
+def _from_dict(data):
+    if 'panposition' in data and 'tiltposition' in data:
+        return float(data['panposition']), float(data['tiltposition'])
+    return None
+
+
+def decode_json(data):
+    """(pan, tilt) from a ptzinfo payload, None if it carries no position"""
+    return _from_dict(json.loads(data.decode()))
+
+
+def decode_fast(data):
+    match = _POSITION.search(data)
+    if match is None:
+        # Other field order, or no position at all
+        return decode_json(data)
+    return float(match[1]), float(match[2])
+
+
+def decode_binary(data):
+    try:
+        return BINARY_POSITION.unpack(data)
+    except struct.error as e:
+        raise ValueError(str(e)) from None
+
+
+def _orjson_decoder():
+    import orjson
+
+    def decode_orjson(data):
+        return _from_dict(orjson.loads(data))
+
+    return decode_orjson
+
+
+def get_decoder(name=DEFAULT_DECODER):
+    """Decoder function for `name`: payload bytes -> (pan, tilt) or None
+
+    Every decoder raises ValueError for a payload it cannot parse.
+    """
+    if name == 'json':
+        return decode_json
+    if name == 'fast':
+        return decode_fast
+    if name == 'orjson':
+        return _orjson_decoder()
+    if name == 'binary':
+        return decode_binary
+    raise ValueError(f"Unknown decoder {name!r}, expected one of {DECODERS}")
+
+
+def decode_batch(decode, payloads, times):
+    """Decode a batch of payloads received at `times`
+
+    Returns contiguous float64 (t, pan, tilt) arrays of the payloads that carry
+    a position, and how many payloads could not be parsed. Binary payloads are
+    decoded in one np.frombuffer call.
+    """
+    if decode is decode_binary:
+        data = b''.join(payloads)
+        if len(data) == BINARY_POSITION.size * len(payloads):
+            values = np.frombuffer(data, dtype='<f8').reshape(-1, 2)
+            return (np.array(times, dtype=float), np.ascontiguousarray(values[:, 0]),
+                    np.ascontiguousarray(values[:, 1]), 0)
+    kept, pans, tilts = [], [], []
+    errors = 0
+    for t, data in zip(times, payloads):
+        try:
+            position = decode(data)
+        except ValueError:
+            errors += 1
+            continue
+        if position is not None:
+            kept.append(t)
+            pans.append(position[0])
+            tilts.append(position[1])
+    return np.array(kept, dtype=float), np.array(pans, dtype=float), np.array(tilts, dtype=float), errors
+
+
+def encode_position(pan, tilt, binary=False):
+    """ptzinfo payload for a position, in the JSON or binary encoding"""
+    if binary:
+        return BINARY_POSITION.pack(pan, tilt)
+    return b'{"panposition": %.3f, "tiltposition": %.3f}' % (pan, tilt)
@@ -1,12 +1,18 @@
 import asyncio
 import json
-import csv
 import pandas as pd
 from nats.aio.client import Client as NATS
+from decoder import get_decoder
+from iothread import IOThread
+from loopmon import LoopLagMonitor
+from loops import run
 from timer import Timer
 
 BOLD = "\033[1m"
 RESET = "\033[0m"
+decode_position = get_decoder()
+# Console and CSV writes run on this thread, away from the loop timing telemetry
+io = IOThread()
 
 async def process_combination(nc, cam_id, gimbal_speed, pan_setpoint, tilt_setpoint):
     POSITION_TOLERANCE = 0.1
@@ -17,41 +23,37 @@ async def process_combination(nc, cam_id, gimbal_speed, pan_setpoint, tilt_setpo
     
     async def message_handler(msg):
         try:
-            data = json.loads(msg.data.decode())
+            position = decode_position(msg.data)
             nonlocal pan_reached, tilt_reached
             
-            if 'panposition' in data and 'tiltposition' in data:
-                current_pan = float(data['panposition'])
-                current_tilt = float(data['tiltposition'])
+            if position is not None:
+                current_pan, current_tilt = position
                 
                 adjusted_current_tilt = -current_tilt if tilt_setpoint > 0 else current_tilt
                 pan_difference = abs(current_pan - pan_setpoint)
                 tilt_difference = abs(adjusted_current_tilt - tilt_setpoint)
                 
                 if not pan_reached and pan_difference <= abs(POSITION_TOLERANCE):
-                    print(f"\nPan target reached at {current_pan:.3f}")
+                    io.print(f"Pan target reached at {current_pan:.3f}")
                     pan_reached = True
                     
                 if not tilt_reached and tilt_difference <= abs(POSITION_TOLERANCE):
-                    print(f"\nTilt target reached at {adjusted_current_tilt:.3f}")
+                    io.print(f"Tilt target reached at {adjusted_current_tilt:.3f}")
                     tilt_reached = True
                 
                 if pan_reached and tilt_reached and not target_reached.is_set():
-                    print(f"\nFinal position: Pan={current_pan:.3f}, Tilt={current_tilt:.3f}")
-                    print(f"Final position Difference: Pan={pan_difference:.3f}, Tilt={tilt_difference:.3f}")
-                    print("Target position reached!")
+                    io.print(f"Final position: Pan={current_pan:.3f}, Tilt={current_tilt:.3f}")
+                    io.print(f"Final position Difference: Pan={pan_difference:.3f}, Tilt={tilt_difference:.3f}")
+                    io.print("Target position reached!")
                     target_reached.set()
-                else:
-                    print(f"Current position: Pan={current_pan:.3f}, Tilt={current_tilt:.3f}, " 
-                          f"Difference: Pan={pan_difference:.3f}, Tilt={tilt_difference:.3f}", end='\r')
             
         except (json.JSONDecodeError, ValueError) as e:
-            print(f"Error processing message: {e}")
+            io.print(f"Error processing message: {e}")
     
     subscription = await nc.subscribe(f"ptzinfo.camera{cam_id}", cb=message_handler)
-    print("="*80)
-    print(f"Testing: Camera {cam_id}, Speed {gimbal_speed}, Pan {pan_setpoint}, Tilt {tilt_setpoint}")
-    print(f"Subscribed to ptzinfo.camera{cam_id}")
+    io.print("="*80)
+    io.print(f"Testing: Camera {cam_id}, Speed {gimbal_speed}, Pan {pan_setpoint}, Tilt {tilt_setpoint}")
+    io.print(f"Subscribed to ptzinfo.camera{cam_id}")
     
     pan_reached = False
     tilt_reached = False
@@ -62,36 +64,38 @@ async def process_combination(nc, cam_id, gimbal_speed, pan_setpoint, tilt_setpo
         "tiltsetpoint": adjusted_tilt,
         "gimbal_speed": gimbal_speed
     }
-    print("Sending control message and starting timer...")
+    io.print("Sending control message and starting timer...")
     await nc.publish(f"ptzcontrol.camera{cam_id}", json.dumps(control_msg).encode())
     timer.start()
 
     try:
         await asyncio.wait_for(target_reached.wait(), timeout=20.0)
         elapsed_time = timer.get_lapsed() / 1000
-        print(f"Target reached in {BOLD}{elapsed_time:.2f} Seconds{RESET}")
+        io.print(f"Target reached in {BOLD}{elapsed_time:.2f} Seconds{RESET}")
         return elapsed_time
     except asyncio.TimeoutError:
-        print("\nTimeout: Target position not reached within 20 seconds")
-        print(f"Pan reached: {pan_reached}, Tilt reached: {tilt_reached}")
+        io.print("Timeout: Target position not reached within 20 seconds")
+        io.print(f"Pan reached: {pan_reached}, Tilt reached: {tilt_reached}")
         return None
     finally:
         timer.stop()
         await subscription.unsubscribe()
 
 async def main():
-    df = pd.read_csv('camera_combinations_new_2.csv')
+    io.start()
+    df = await asyncio.to_thread(pd.read_csv, 'camera_combinations_new_2.csv')
     
     if 'execution_time' not in df.columns:
         df['execution_time'] = None
     
     nc = NATS()
     await nc.connect("nats://localhost:4222")
+    monitor = LoopLagMonitor().start()
     
     try:
         for index, row in df.iterrows():
             if pd.isna(row['execution_time']):
-                print(f"\nProcessing combination {index + 1} of {len(df)}")
+                io.print(f"\nProcessing combination {index + 1} of {len(df)}")
                 
                 execution_time = await process_combination(
                     nc,
@@ -102,13 +106,17 @@ async def main():
                 )
                 
                 df.at[index, 'execution_time'] = execution_time
-                df.to_csv('camera_combinations_new_2.csv', index=False)
+                io.submit(df.copy().to_csv, 'camera_combinations_new_2.csv', index=False)
                 await asyncio.sleep(2)
         
-        print("\nAll combinations tested successfully!")
+        io.print("\nAll combinations tested successfully!")
         
     finally:
+        await monitor.stop()
+        io.print(monitor.report())
         await nc.drain()
+        await io.drain()
+        io.close()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    run(main())
\ No newline at end of file
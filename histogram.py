@@ -0,0 +1,111 @@
+import math
+from array import array
+
+LOWEST = 1e-6
+HIGHEST = 100.0
+GROWTH = 1.02
+
+
+class Histogram:
+    """Log-bucketed histogram of positive values (seconds) with fixed storage
+
+    Recording a value is a log and an array increment, so it can sit on the
+    telemetry path; every bucket is at most GROWTH-1 (2%) wide relative to
+    its value.
+    """
+    __slots__ = ['lowest', 'highest', 'growth', 'counts', 'count', 'total', 'min', 'max', '_scale']
+
+    def __init__(self, lowest=LOWEST, highest=HIGHEST, growth=GROWTH):
+        self.lowest = lowest
+        self.highest = highest
+        self.growth = growth
+        self._scale = 1.0 / math.log(growth)
+        buckets = int(math.log(highest / lowest) * self._scale) + 2
+        self.counts = array('Q', bytes(8 * buckets))
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def record(self, value):
+        if value <= self.lowest:
+            bucket = 0
+        else:
+            bucket = int(math.log(value / self.lowest) * self._scale) + 1
+            if bucket >= len(self.counts):
+                bucket = len(self.counts) - 1
+        self.counts[bucket] += 1
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        if (len(other.counts) != len(self.counts) or other.growth != self.growth
+                or other.lowest != self.lowest):
+            raise ValueError("Cannot merge histograms with different bucket layouts")
+        for i, n in enumerate(other.counts):
+            if n:
+                self.counts[i] += n
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def percentile(self, q):
+        """Value below which a fraction q of recorded values fall, or None if empty"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bucket, n in enumerate(self.counts):
+            seen += n
+            if n and seen >= rank:
+                if bucket == 0:
+                    return self.min
+                # Geometric middle of the bucket, clamped to what was actually seen
+                value = self.lowest * self.growth ** (bucket - 0.5)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def buckets(self):
+        """(upper bound, count) of every non-empty bucket, in increasing order"""
+        return [(self.lowest * self.growth ** bucket, n) for bucket, n in enumerate(self.counts) if n]
+
+    def to_dict(self):
+        """JSON-ready state with only the non-empty buckets, see from_dict"""
+        return {
+            'lowest': self.lowest, 'highest': self.highest, 'growth': self.growth,
+            'count': self.count, 'total': self.total, 'min': self.min if self.count else None, 'max': self.max,
+            'counts': {str(bucket): n for bucket, n in enumerate(self.counts) if n},
+        }
+
+    @classmethod
+    def from_dict(cls, state):
+        histogram = cls(state['lowest'], state['highest'], state['growth'])
+        for bucket, n in state['counts'].items():
+            histogram.counts[int(bucket)] = n
+        histogram.count = state['count']
+        histogram.total = state['total']
+        histogram.min = math.inf if state['min'] is None else state['min']
+        histogram.max = state['max']
+        return histogram
+
+    def summary(self):
+        if not self.count:
+            return {'count': 0}
+        return {
+            'count': self.count,
+            'mean': self.mean(),
+            'min': self.min,
+            'p50': self.percentile(0.5),
+            'p90': self.percentile(0.9),
+            'p99': self.percentile(0.99),
+            'p999': self.percentile(0.999),
+            'max': self.max,
+        }
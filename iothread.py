@@ -0,0 +1,82 @@
+import asyncio
+import queue
+import sys
+import threading
+
+_STOP = object()
+
+
+class IOThread:
+    """One writer thread running blocking file and console I/O in submission order
+
+    The event loop thread only enqueues work, so a slow disk or terminal can
+    no longer delay the timestamping of telemetry. Work submitted from one
+    thread is executed in the order it was submitted.
+    """
+
+    def __init__(self, name='io-writer'):
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.errors = 0
+        self.started = False
+
+    def start(self):
+        if not self.started:
+            self._thread.start()
+            self.started = True
+        return self
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            fn, args, kwargs, future = item
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                self.errors += 1
+                if future is None:
+                    print(f"Error in background write {getattr(fn, '__name__', fn)}: {e}", file=sys.stderr)
+                else:
+                    future.get_loop().call_soon_threadsafe(_settle, future, None, e)
+                continue
+            if future is not None:
+                future.get_loop().call_soon_threadsafe(_settle, future, result, None)
+
+    def submit(self, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) on the writer thread without waiting for it"""
+        self._queue.put((fn, args, kwargs, None))
+
+    def print(self, *args, **kwargs):
+        self.submit(print, *args, flush=True, **kwargs)
+
+    async def call(self, fn, *args, **kwargs):
+        """Run fn on the writer thread after everything queued before it, and await its result"""
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put((fn, args, kwargs, future))
+        return await future
+
+    async def drain(self):
+        """Wait until everything submitted so far has been written"""
+        await self.call(_noop)
+
+    def close(self):
+        """Finish every queued write and stop the thread"""
+        if self.started:
+            self._queue.put(_STOP)
+            self._thread.join()
+            self.started = False
+
+
+def _noop():
+    return None
+
+
+def _settle(future, result, error):
+    if future.cancelled():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
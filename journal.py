@@ -0,0 +1,175 @@
+import argparse
+import csv
+import json
+import os
+import time
+
+from plan import Plan
+
+JOURNAL_PATH = "sweep.journal"
+FSYNC_EVERY = 32
+FSYNC_INTERVAL = 1.0
+
+
+class Journal:
+    """Append-only JSON-lines log holding one record per completed move"""
+
+    def __init__(self, path=JOURNAL_PATH, fsync_every=FSYNC_EVERY, fsync_interval=FSYNC_INTERVAL):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        _truncate_torn_tail(path)
+        self._file = open(path, 'ab')
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def append(self, record):
+        self._file.write(json.dumps(record, separators=(',', ':')).encode() + b'\n')
+        self._file.flush()
+        self._unsynced += 1
+        if (self._unsynced >= self.fsync_every
+                or time.monotonic() - self._last_sync >= self.fsync_interval):
+            self.sync()
+
+    def sync(self):
+        """Force every appended record to disk"""
+        if self._unsynced:
+            os.fsync(self._file.fileno())
+            self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        self.sync()
+        self._file.close()
+
+
+def _truncate_torn_tail(path):
+    # A crash mid-write leaves a partial last line; drop it so appends stay parseable
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb+') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if size == 0:
+            return
+        f.seek(size - 1)
+        if f.read(1) == b'\n':
+            return
+        f.seek(0)
+        data = f.read()
+        f.truncate(data.rfind(b'\n') + 1)
+
+
+def read_journal(path):
+    """Yield journal records in write order, stopping at a torn final line"""
+    with open(path, 'rb') as f:
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                break
+
+
+def load_state(path):
+    """Latest record per (plan, row), rebuilt in a single pass over the journal"""
+    state = {}
+    if os.path.exists(path):
+        for record in read_journal(path):
+            state[(record['plan'], record['row'])] = record
+    return state
+
+
+def rotate(path, keep=()):
+    """Archive the journal under a timestamped name and start a fresh one
+
+    Records of plans in `keep` are carried over to the fresh journal.
+    Returns the archive path, or None when there was no journal.
+    """
+    if not os.path.exists(path):
+        return None
+    kept = [record for record in read_journal(path) if os.path.normpath(record['plan']) in keep]
+    archive = f"{path}.{time.strftime('%Y%m%d-%H%M%S')}"
+    suffix = 1
+    while os.path.exists(archive):
+        suffix += 1
+        archive = f"{path}.{time.strftime('%Y%m%d-%H%M%S')}-{suffix}"
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        for record in kept:
+            f.write(json.dumps(record, separators=(',', ':')).encode() + b'\n')
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path, archive)
+    os.replace(tmp_path, path)
+    return archive
+
+
+def compact(path, plan_paths, rotate_journal=True):
+    """Write the journalled results back into each plan CSV, then rotate the journal
+
+    Once the results are in the plans the journal has done its job; keeping
+    it would re-apply them to a later plan saved under the same name.
+    Records of plans not compacted here stay in the live journal.
+    """
+    state = load_state(path)
+    compacted = set()
+    for plan_path in plan_paths:
+        plan = Plan(plan_path)
+        plan.apply(state)
+        plan.save()
+        compacted.add(plan.path)
+    if rotate_journal:
+        others = {os.path.normpath(p) for p, _ in state} - compacted
+        return rotate(path, keep=others)
+    return None
+
+
+def export(path, out_path):
+    """Write the latest record of every move to a CSV, Parquet or Feather table"""
+    records = list(load_state(path).values())
+    fieldnames = []
+    for record in records:
+        for key in record:
+            if key not in fieldnames:
+                fieldnames.append(key)
+
+    extension = os.path.splitext(out_path)[1].lower()
+    if extension in ('.parquet', '.feather'):
+        import pandas as pd
+        df = pd.DataFrame.from_records(records, columns=fieldnames)
+        if extension == '.parquet':
+            df.to_parquet(out_path, index=False)
+        else:
+            df.to_feather(out_path)
+    else:
+        with open(out_path, 'w', newline='') as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerows(records)
+    return len(records)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compact a sweep journal into plan CSVs or a table")
+    parser.add_argument('journal', nargs='?', default=JOURNAL_PATH, help="journal file")
+    parser.add_argument('--plans', nargs='*', default=[], help="plan CSVs to write results back into")
+    parser.add_argument('--export', help="write all records to a .csv, .parquet or .feather file")
+    parser.add_argument('--keep-journal', action='store_true',
+                        help="leave the journal in place after compacting instead of archiving it")
+    args = parser.parse_args(argv)
+
+    # Export first: compacting archives the journal
+    if args.export:
+        count = export(args.journal, args.export)
+        print(f"Exported {count} records to {args.export}")
+    if args.plans:
+        archive = compact(args.journal, args.plans, rotate_journal=not args.keep_journal)
+        print(f"Compacted {args.journal} into {', '.join(args.plans)}")
+        if archive:
+            print(f"Journal archived to {archive}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+import asyncio
+import time
+
+from histogram import Histogram
+
+LAG_INTERVAL = 0.01
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes a task sleeping a fixed interval
+
+    Any blocking call on the loop thread shows up as lag, and so does any
+    delay in timestamping telemetry that arrives during it.
+    """
+
+    def __init__(self, interval=LAG_INTERVAL, on_lag=None):
+        self.interval = interval
+        self.on_lag = on_lag
+        self.lag = Histogram()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        # perf_counter rather than loop.time(), which uvloop keeps in whole milliseconds
+        interval = self.interval
+        on_lag = self.on_lag
+        while True:
+            expected = time.perf_counter() + interval
+            await asyncio.sleep(interval)
+            lag = max(time.perf_counter() - expected, 0.0)
+            self.lag.record(lag)
+            if on_lag is not None:
+                on_lag(lag)
+
+    def report(self):
+        """One-line summary of the lag seen so far"""
+        lag = self.lag
+        if not lag.count:
+            return "Event loop lag: no samples"
+        return (f"Event loop lag over {lag.count} wakeups: p50 {lag.percentile(0.5) * 1000:.2f} ms, "
+                f"p99 {lag.percentile(0.99) * 1000:.2f} ms, max {lag.max * 1000:.2f} ms")
@@ -0,0 +1,44 @@
+import asyncio
+
+# auto:    uvloop when it is installed, the default asyncio loop otherwise
+# asyncio: always the default loop
+# uvloop:  uvloop, failing if it is not installed
+LOOPS = ('auto', 'asyncio', 'uvloop')
+
+
+def loop_factory(backend='auto'):
+    """Event loop factory for `backend`, None for the default asyncio loop"""
+    if backend not in LOOPS:
+        raise ValueError(f"Unknown loop backend {backend!r}, expected one of {LOOPS}")
+    if backend == 'asyncio':
+        return None
+    try:
+        import uvloop
+    except ImportError:
+        if backend == 'uvloop':
+            raise
+        return None
+    return uvloop.new_event_loop
+
+
+def backend_name(backend='auto'):
+    """Name of the loop `backend` resolves to here"""
+    return 'asyncio' if loop_factory(backend) is None else 'uvloop'
+
+
+def run(main, backend='auto'):
+    """asyncio.run(main) on the selected event loop backend"""
+    factory = loop_factory(backend)
+    if factory is None:
+        return asyncio.run(main)
+    if hasattr(asyncio, 'Runner'):
+        with asyncio.Runner(loop_factory=factory) as runner:
+            return runner.run(main)
+    # Python before 3.11
+    loop = factory()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(main)
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
@@ -0,0 +1,202 @@
+import argparse
+import bisect
+import csv
+import glob
+import json
+import os
+import re
+
+import numpy as np
+
+from timeouts import result_moves, timed_out_moves
+
+MODEL_PATH = "movemodel.json"
+RESULT_SOURCES = ('Results/*.csv', 'utils/Venue*/Result/*.csv')
+# Knots of the piecewise-linear |delta pan| curve, in degrees; extended when the data goes further
+KNOTS = (0.0, 5.0, 10.0, 20.0, 30.0, 40.0, 50.0, 60.0, 70.0, 80.0, 90.0, 100.0)
+SMOOTHING = 0.1
+MIN_SAMPLES = 3
+ALL_CAMERAS = '*'
+
+
+def _venue_moves(path):
+    # Venue result tables: Gimbal Speed, Pan Start, Pan End, Time, camera id in the file name
+    match = re.search(r'_(\d+)\.csv$', path)
+    if match is None:
+        return
+    cam_id = int(match.group(1))
+    with open(path, newline='') as csvfile:
+        reader = csv.reader(csvfile)
+        next(reader, None)
+        for row in reader:
+            try:
+                speed, start, end, seconds = row[:4]
+                yield cam_id, int(float(speed)), float(end) - float(start), 0.0, float(seconds)
+            except ValueError:
+                continue
+
+
+def read_moves(path, outliers=False):
+    """Every timed move in one results CSV, in either the plan or the venue layout (see result_moves)"""
+    with open(path, newline='') as csvfile:
+        header = next(csv.reader(csvfile), [])
+    if 'cam_id' in header:
+        with open(path, newline='') as csvfile:
+            return list(result_moves(csv.DictReader(csvfile), outliers))
+    if header and header[0].strip() == 'Gimbal Speed':
+        return list(_venue_moves(path))
+    return []
+
+
+def read_timeouts(path):
+    """Every timed-out move with a recorded timeout in one results CSV (see timed_out_moves)"""
+    with open(path, newline='') as csvfile:
+        reader = csv.DictReader(csvfile)
+        if 'cam_id' not in (reader.fieldnames or []):
+            return []
+        return list(timed_out_moves(reader))
+
+
+def load_samples(patterns=RESULT_SOURCES):
+    """(cam_id, gimbal_speed, |delta pan|, |delta tilt|, time) columns from every matching results CSV"""
+    moves = []
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)):
+            moves.extend(read_moves(path))
+    data = np.array(moves, dtype=float).reshape(-1, 5)
+    keep = np.isfinite(data).all(axis=1) & (data[:, 4] > 0)
+    data = data[keep]
+    return (data[:, 0].astype(int), data[:, 1].astype(int), np.abs(data[:, 2]), np.abs(data[:, 3]), data[:, 4])
+
+
+def hat_basis(knots, x):
+    """(len(x), len(knots)) piecewise-linear interpolation weights, extrapolating past the end knots"""
+    knots = np.asarray(knots, dtype=float)
+    segment = np.clip(np.searchsorted(knots, x, side='right') - 1, 0, len(knots) - 2)
+    weight = (x - knots[segment]) / (knots[segment + 1] - knots[segment])
+    basis = np.zeros((len(x), len(knots)))
+    rows = np.arange(len(x))
+    basis[rows, segment] = 1.0 - weight
+    basis[rows, segment + 1] = weight
+    return basis
+
+
+def fit_curve(knots, pan, tilt, seconds, smoothing=SMOOTHING):
+    """Least-squares curve values at the knots plus seconds per degree of tilt
+
+    A second-difference penalty keeps knots with few samples near a straight
+    line between their neighbours.
+    """
+    k = len(knots)
+    design = np.hstack([hat_basis(knots, pan), tilt[:, None]])
+    penalty = np.zeros((k - 2, k + 1))
+    for i in range(k - 2):
+        penalty[i, i:i + 3] = (1.0, -2.0, 1.0)
+    penalty *= smoothing * np.sqrt(len(seconds))
+    a = np.vstack([design, penalty])
+    b = np.concatenate([seconds, np.zeros(k - 2)])
+    solution = np.linalg.lstsq(a, b, rcond=None)[0]
+    residual = design @ solution - seconds
+    return solution[:k], float(solution[k]), float(np.sqrt(np.mean(residual * residual)))
+
+
+class MoveModel:
+    """Fitted move time per (camera, gimbal_speed) against |delta pan| and |delta tilt|
+
+    Each curve is piecewise linear in |delta pan| over shared knots plus a
+    linear |delta tilt| term. Cameras without their own curve for a speed use
+    the curve fitted over all cameras.
+    """
+
+    def __init__(self, knots=KNOTS, curves=None):
+        self.knots = tuple(float(k) for k in knots)
+        # (cam_id or ALL_CAMERAS, gimbal_speed) -> (values at knots, tilt slope, samples, rmse)
+        self.curves = curves or {}
+
+    @classmethod
+    def fit(cls, cam_ids, speeds, pan, tilt, seconds, knots=KNOTS, smoothing=SMOOTHING, min_samples=MIN_SAMPLES):
+        knots = list(knots)
+        if len(pan) and pan.max() > knots[-1]:
+            knots.append(float(np.ceil(pan.max())))
+        model = cls(knots)
+        groups = [((ALL_CAMERAS, speed), speeds == speed) for speed in np.unique(speeds)]
+        groups += [((int(cam), int(speed)), (cam_ids == cam) & (speeds == speed))
+                   for cam, speed in np.unique(np.stack([cam_ids, speeds], axis=1), axis=0)]
+        for key, mask in groups:
+            if mask.sum() < min_samples:
+                continue
+            values, tilt_slope, rmse = fit_curve(knots, pan[mask], tilt[mask], seconds[mask], smoothing)
+            model.curves[(key[0], int(key[1]))] = (tuple(values.tolist()), tilt_slope, int(mask.sum()), rmse)
+        return model
+
+    def curve(self, cam_id, gimbal_speed):
+        curve = self.curves.get((cam_id, gimbal_speed))
+        if curve is None:
+            curve = self.curves.get((ALL_CAMERAS, gimbal_speed))
+        return curve
+
+    def predict_time(self, cam_id, gimbal_speed, delta_pan, delta_tilt=0.0):
+        """Predicted move time in seconds, None for a speed never measured"""
+        curve = self.curve(cam_id, gimbal_speed)
+        if curve is None:
+            return None
+        values, tilt_slope = curve[0], curve[1]
+        knots = self.knots
+        x = abs(delta_pan)
+        i = min(max(bisect.bisect_right(knots, x) - 1, 0), len(knots) - 2)
+        w = (x - knots[i]) / (knots[i + 1] - knots[i])
+        return max(values[i] + w * (values[i + 1] - values[i]) + tilt_slope * abs(delta_tilt), 0.0)
+
+    def predict(self, cam_id, gimbal_speed, delta_pan, delta_tilt):
+        # Same signature as MoveTimeEstimator.predict, so either can be used as a prior
+        return self.predict_time(cam_id, gimbal_speed, delta_pan, delta_tilt)
+
+    def predict_many(self, cam_id, gimbal_speed, delta_pan, delta_tilt):
+        """Vectorized predict_time over arrays of deltas, which broadcast against each other"""
+        curve = self.curve(cam_id, gimbal_speed)
+        if curve is None:
+            return None
+        pan = np.abs(np.asarray(delta_pan, dtype=float))
+        along_pan = (hat_basis(self.knots, pan.ravel()) @ np.asarray(curve[0])).reshape(pan.shape)
+        return np.maximum(along_pan + curve[1] * np.abs(delta_tilt), 0.0)
+
+    def save(self, path=MODEL_PATH):
+        curves = [{'cam_id': cam, 'gimbal_speed': speed, 'values': list(values), 'tilt_slope': tilt_slope,
+                   'samples': samples, 'rmse': rmse}
+                  for (cam, speed), (values, tilt_slope, samples, rmse) in sorted(self.curves.items(), key=str)]
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'knots': list(self.knots), 'curves': curves}, f, indent=1)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=MODEL_PATH):
+        with open(path) as f:
+            data = json.load(f)
+        curves = {(c['cam_id'], c['gimbal_speed']): (tuple(c['values']), c['tilt_slope'], c['samples'], c['rmse'])
+                  for c in data['curves']}
+        return cls(data['knots'], curves)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fit the move-time model from every results CSV")
+    parser.add_argument('sources', nargs='*', default=list(RESULT_SOURCES),
+                        help="results CSVs (paths or globs), plan or venue layout")
+    parser.add_argument('-o', '--output', default=MODEL_PATH, help="fitted model JSON")
+    parser.add_argument('--smoothing', type=float, default=SMOOTHING, help="curvature penalty weight")
+    parser.add_argument('--min-samples', type=int, default=MIN_SAMPLES,
+                        help="fewest moves a (camera, speed) curve is fitted from")
+    args = parser.parse_args(argv)
+
+    samples = load_samples(args.sources)
+    model = MoveModel.fit(*samples, smoothing=args.smoothing, min_samples=args.min_samples)
+    model.save(args.output)
+    print(f"Fitted {len(model.curves)} curves from {len(samples[4])} moves")
+    for (cam, speed), (values, tilt_slope, samples_used, rmse) in sorted(model.curves.items(), key=str):
+        print(f"camera {cam} speed {speed}: {samples_used:>4} moves, rmse {rmse:.2f} s, "
+              f"50 deg {model.predict_time(cam, speed, 50):.2f} s, 100 deg {model.predict_time(cam, speed, 100):.2f} s")
+    print(f"Model written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+import csv
+import os
+
+PLAN_COLUMNS = ('cam_id', 'gimbal_speed', 'pan_setpoint', 'tilt_setpoint')
+
+
+def plan_path(spec):
+    """Map a bare camera id to its combinations file, pass paths through"""
+    if spec.isdigit():
+        return f"camera_combinations_new_{spec}.csv"
+    return spec
+
+
+class Plan:
+    """A combinations CSV kept as plain rows and written back in place"""
+
+    def __init__(self, path):
+        self.path = os.path.normpath(path)
+        with open(path, newline='') as csvfile:
+            reader = csv.DictReader(csvfile)
+            self.fieldnames = list(reader.fieldnames)
+            self.rows = list(reader)
+        if 'execution_time' not in self.fieldnames:
+            self.fieldnames.append('execution_time')
+
+    def pending(self):
+        """Yield (index, row) for every row without an execution time"""
+        for index, row in enumerate(self.rows):
+            if not row.get('execution_time'):
+                yield index, row
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', newline='') as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=self.fieldnames)
+            writer.writeheader()
+            writer.writerows(self.rows)
+        os.replace(tmp_path, self.path)
+
+    def matches(self, index, record):
+        """Whether a journal record was taken for this row's combination, not just its index"""
+        row = self.rows[index]
+        for key in PLAN_COLUMNS:
+            if key not in record:
+                continue
+            try:
+                if float(row[key]) != float(record[key]):
+                    return False
+            except (KeyError, TypeError, ValueError):
+                return False
+        return True
+
+    def apply(self, state):
+        """Copy the journalled result of each of this plan's rows back into it"""
+        for (path, index), record in state.items():
+            if path != self.path or index >= len(self.rows) or not self.matches(index, record):
+                continue
+            row = self.rows[index]
+            for key, value in record.items():
+                if key in ('plan', 'row') or key in PLAN_COLUMNS:
+                    continue
+                if key not in self.fieldnames:
+                    self.fieldnames.append(key)
+                row[key] = '' if value is None else value
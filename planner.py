@@ -0,0 +1,230 @@
+import argparse
+import csv
+from collections import deque
+
+from movemodel import MODEL_PATH, MoveModel
+from plan import PLAN_COLUMNS, Plan
+from simulator import model_move_time
+from timeouts import MoveTimeEstimator
+
+BOLD = "\033[1m"
+RESET = "\033[0m"
+
+# previous: a row measures the move from the row before it (sweep.py, gimbaltimer_*.py)
+# home:     a row measures the move from pan 0 / tilt 0, the gimbal being sent home first
+#           (utils/automated-gimbal_v1.py)
+SOURCES = ('previous', 'home')
+WINDOW = 64
+MOVE_OVERHEAD = 0.5
+REPOSITION_SPEED = 1
+
+# Positions are handled in the gimbal's frame: pan as commanded and tilt as the
+# tiltsetpoint actually sent, which is never positive (see CameraChannel.move).
+
+
+def device_tilt(tilt_setpoint):
+    return -tilt_setpoint if tilt_setpoint > 0 else tilt_setpoint
+
+
+def required_moves(rows, source='previous', home=(0.0, 0.0)):
+    """Per camera: the start position and the (gimbal_speed, delta_pan, delta_tilt) each row measures"""
+    starts = {}
+    moves = {}
+    previous = {}
+    for row in rows:
+        cam_id = int(row['cam_id'])
+        target = (float(row['pan_setpoint']), device_tilt(float(row['tilt_setpoint'])))
+        start = home if source == 'home' else previous.get(cam_id)
+        previous[cam_id] = target
+        if start is None:
+            # The first row of a sequential plan only positions the gimbal
+            starts[cam_id] = target
+            continue
+        starts.setdefault(cam_id, start)
+        moves.setdefault(cam_id, []).append((int(float(row['gimbal_speed'])),
+                                             target[0] - start[0], target[1] - start[1]))
+    return starts, moves
+
+
+class MoveCost:
+    """Predicted move times: fitted from earlier results where possible, else the nominal gimbal model"""
+
+    def __init__(self, estimator=None, model=None):
+        self.estimator = estimator or MoveTimeEstimator()
+        self.model = model
+
+    def time(self, cam_id, gimbal_speed, delta_pan, delta_tilt):
+        predicted = self.estimator.predict(cam_id, gimbal_speed, delta_pan, delta_tilt)
+        if predicted is None and self.model is not None:
+            predicted = self.model.predict_time(cam_id, gimbal_speed, delta_pan, delta_tilt)
+        if predicted is None:
+            predicted = model_move_time(gimbal_speed, delta_pan, delta_tilt)
+        return predicted
+
+
+def order_moves(moves, start, pan_range, tilt_range, keep_sign=False, window=WINDOW,
+                reposition_speed=REPOSITION_SPEED):
+    """Chain measured moves so each starts where the previous one ended
+
+    Returns (gimbal_speed, pan, tilt, purpose) targets, purpose being 'measure'
+    or 'reposition'. The next move is picked greedily among the first
+    `window` remaining ones: the largest that fits inside the range from
+    where the gimbal is, ending nearest the middle. Without keep_sign each
+    axis may run in either direction. A reposition is inserted only when no
+    candidate fits. Linear in the plan size for a fixed window.
+    """
+    pan_low, pan_high = pan_range
+    tilt_low, tilt_high = tilt_range
+    pan_mid = 0.5 * (pan_low + pan_high)
+    tilt_mid = 0.5 * (tilt_low + tilt_high)
+    pan_scale = max(pan_high - pan_low, 1e-9)
+    tilt_scale = max(tilt_high - tilt_low, 1e-9)
+    signs = ((1, 1),) if keep_sign else ((1, 1), (1, -1), (-1, 1), (-1, -1))
+
+    def best_end(pan, tilt, move):
+        speed, dp, dt = move
+        best = None
+        for sp, st in signs:
+            end_pan = pan + sp * dp
+            end_tilt = tilt + st * dt
+            if not (pan_low <= end_pan <= pan_high and tilt_low <= end_tilt <= tilt_high):
+                continue
+            # Largest move first, since big moves only fit from near the edges; then
+            # the end nearer the middle, which leaves the most room for the next one
+            score = (abs(end_pan - pan_mid) / pan_scale + abs(end_tilt - tilt_mid) / tilt_scale
+                     - 2 * (abs(dp) / pan_scale + abs(dt) / tilt_scale))
+            if best is None or score < best[0]:
+                best = (score, end_pan, end_tilt)
+        return best
+
+    pan, tilt = start
+    remaining = deque(moves)
+    targets = []
+    while remaining:
+        choice = None
+        for i in range(min(window, len(remaining))):
+            end = best_end(pan, tilt, remaining[i])
+            if end is not None and (choice is None or end[0] < choice[1][0]):
+                choice = (i, end)
+        if choice is None:
+            # Nothing fits from here: go to where the next move ends up centred
+            speed, dp, dt = remaining[0]
+            pan = min(max(pan_mid - 0.5 * dp, pan_low), pan_high)
+            tilt = min(max(tilt_mid - 0.5 * dt, tilt_low), tilt_high)
+            targets.append((reposition_speed, pan, tilt, 'reposition'))
+            if best_end(pan, tilt, remaining[0]) is None:
+                raise ValueError(f"Move {remaining[0]} does not fit in pan {pan_range}, tilt {tilt_range}")
+            continue
+        i, (_, pan, tilt) = choice
+        targets.append((remaining[i][0], pan, tilt, 'measure'))
+        del remaining[i]
+    return targets
+
+
+def travel(start, targets):
+    """Sweep duration inputs: (gimbal_speed, delta_pan, delta_tilt, purpose) of every move in order"""
+    pan, tilt = start
+    steps = []
+    for speed, end_pan, end_tilt, purpose in targets:
+        steps.append((speed, end_pan - pan, end_tilt - tilt, purpose))
+        pan, tilt = end_pan, end_tilt
+    return steps
+
+
+def summarize(cam_id, steps, cost, overhead=MOVE_OVERHEAD):
+    """Move count, unmeasured moves and travel, and estimated duration of a sequence of moves"""
+    duration = 0.0
+    unmeasured = 0
+    idle_travel = 0.0
+    for speed, dp, dt, purpose in steps:
+        duration += cost.time(cam_id, speed, dp, dt) + overhead
+        if purpose != 'measure':
+            unmeasured += 1
+            idle_travel += max(abs(dp), abs(dt))
+    return {'moves': len(steps), 'unmeasured': unmeasured, 'idle_travel': idle_travel, 'duration': duration}
+
+
+def original_steps(moves, cam_id, source, home=(0.0, 0.0)):
+    """The sweep as the input plan would run it"""
+    if source == 'previous':
+        return [(speed, dp, dt, 'measure') for speed, dp, dt in moves[cam_id]]
+    # Homing: every measured move is preceded by a move back home from the last target
+    steps = []
+    pan, tilt = home
+    for speed, dp, dt in moves[cam_id]:
+        if (pan, tilt) != home:
+            steps.append((speed, home[0] - pan, home[1] - tilt, 'home'))
+        steps.append((speed, dp, dt, 'measure'))
+        pan, tilt = home[0] + dp, home[1] + dt
+    return steps
+
+
+def write_plan(path, rows):
+    with open(path, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(list(PLAN_COLUMNS) + ['purpose'])
+        writer.writerows(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Reorder a combination plan so each move starts where the previous one ended")
+    parser.add_argument('plan', help="combination CSV to optimize")
+    parser.add_argument('-o', '--output', required=True, help="optimized combination CSV to write")
+    parser.add_argument('--source', choices=SOURCES, default='previous',
+                        help="what each input row measures: the move from the previous row, or from home")
+    parser.add_argument('--keep-sign', action='store_true',
+                        help="keep each move's direction instead of letting either direction count")
+    parser.add_argument('--window', type=int, default=WINDOW,
+                        help="how many upcoming moves are considered at each step")
+    parser.add_argument('--pan-range', type=float, nargs=2, metavar=('LOW', 'HIGH'),
+                        help="allowed pan positions (default: the range the plan uses)")
+    parser.add_argument('--tilt-range', type=float, nargs=2, metavar=('LOW', 'HIGH'),
+                        help="allowed tilt positions as sent to the gimbal (default: the range the plan uses)")
+    parser.add_argument('--reposition-speed', type=int, default=REPOSITION_SPEED,
+                        help="gimbal_speed of inserted repositioning moves")
+    parser.add_argument('--overhead', type=float, default=MOVE_OVERHEAD,
+                        help="seconds added to every move for settling and bookkeeping")
+    parser.add_argument('--history', nargs='*', default=[],
+                        help="earlier results CSVs (paths or globs) to predict move times from")
+    parser.add_argument('--model', nargs='?', const=MODEL_PATH,
+                        help=f"fitted move-time model ({MODEL_PATH}, see movemodel.py) to predict from")
+    args = parser.parse_args(argv)
+
+    plan = Plan(args.plan)
+    estimator = MoveTimeEstimator()
+    estimator.load_results(args.history)
+    cost = MoveCost(estimator, MoveModel.load(args.model) if args.model else None)
+
+    pans = [float(row['pan_setpoint']) for row in plan.rows]
+    tilts = [device_tilt(float(row['tilt_setpoint'])) for row in plan.rows]
+    pan_range = tuple(args.pan_range) if args.pan_range else (min(pans), max(pans))
+    tilt_range = tuple(args.tilt_range) if args.tilt_range else (min(tilts), max(tilts))
+    if tilt_range[1] > 0:
+        parser.error("tilt positions sent to the gimbal are never positive, use a range up to 0")
+    home = (min(max(0.0, pan_range[0]), pan_range[1]), min(max(0.0, tilt_range[0]), tilt_range[1]))
+    starts, moves = required_moves(plan.rows, args.source, home)
+
+    rows = []
+    for cam_id in sorted(moves):
+        targets = order_moves(moves[cam_id], starts[cam_id], pan_range, tilt_range, keep_sign=args.keep_sign,
+                              window=args.window, reposition_speed=args.reposition_speed)
+        # The sweep starts from wherever the gimbal is, so open with a move to the chain's start
+        first = (args.reposition_speed, *starts[cam_id], 'reposition')
+        rows.extend((cam_id, speed, round(pan, 3), round(tilt, 3), purpose)
+                    for speed, pan, tilt, purpose in [first] + targets)
+
+        before = summarize(cam_id, original_steps(moves, cam_id, args.source, home), cost, args.overhead)
+        after = summarize(cam_id, travel(starts[cam_id], targets), cost, args.overhead)
+        print(f"Camera {cam_id}: {len(moves[cam_id])} measured moves")
+        print(f"  before: {before['moves']} moves, {before['unmeasured']} unmeasured covering "
+              f"{before['idle_travel']:.0f} deg, estimated {before['duration'] / 60:.1f} min")
+        print(f"  after:  {after['moves']} moves, {after['unmeasured']} unmeasured covering "
+              f"{after['idle_travel']:.0f} deg, estimated {BOLD}{after['duration'] / 60:.1f} min{RESET}")
+
+    write_plan(args.output, rows)
+    print(f"Wrote {len(rows)} rows to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+import json
+import time
+
+from histogram import Histogram
+from loopmon import LAG_INTERVAL, LoopLagMonitor
+
+PROFILE_PATH = "profile.json"
+# A move is flagged when the harness itself could have shifted its timestamps
+# by more than this: the loop woke late, or one handler call ran this long.
+QUALITY_THRESHOLD = 0.01
+
+
+class MoveProfile:
+    """Harness disturbances seen while one move was in flight"""
+    __slots__ = ['published', 'first_callback', 'max_loop_lag', 'max_handler_time']
+
+    def __init__(self, published):
+        self.published = published
+        self.first_callback = None
+        self.max_loop_lag = 0.0
+        self.max_handler_time = 0.0
+
+
+class CameraProfile:
+    """Per-camera histograms of handler time, loop lag, publish-to-callback and persistence"""
+    __slots__ = ['cam_id', 'threshold', 'handler', 'loop_lag', 'first_callback', 'persistence', 'moves',
+                 'skewed']
+
+    def __init__(self, cam_id, threshold=QUALITY_THRESHOLD):
+        self.cam_id = cam_id
+        self.threshold = threshold
+        self.handler = Histogram()
+        self.loop_lag = Histogram()
+        self.first_callback = Histogram()
+        self.persistence = Histogram()
+        self.moves = []
+        self.skewed = 0
+
+    def wrap(self, handler):
+        """Subscription callback timing every call of `handler`"""
+        async def profiled_handler(msg):
+            start = time.perf_counter()
+            await handler(msg)
+            for move in self.moves:
+                if move.first_callback is None:
+                    move.first_callback = start - move.published
+                    self.first_callback.record(move.first_callback)
+            self.handled(time.perf_counter() - start)
+        return profiled_handler
+
+    def handled(self, elapsed):
+        """Record one handler run of `elapsed` seconds, e.g. a conflated batch processed off the callback"""
+        self.handler.record(elapsed)
+        for move in self.moves:
+            if elapsed > move.max_handler_time:
+                move.max_handler_time = elapsed
+
+    def timed(self, fn):
+        """`fn` recording its duration as persistence time, for use on the writer thread"""
+        def timed_fn(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.persistence.record(time.perf_counter() - start)
+        return timed_fn
+
+    def begin_move(self, published):
+        move = MoveProfile(published)
+        self.moves.append(move)
+        return move
+
+    def abandon_move(self, move):
+        """Drop a move that never completed, e.g. because its command could not be sent"""
+        self.moves.remove(move)
+
+    def end_move(self, move):
+        """Result columns describing how much the harness disturbed this move"""
+        self.moves.remove(move)
+        skewed = move.max_loop_lag > self.threshold or move.max_handler_time > self.threshold
+        self.skewed += skewed
+        return {
+            'max_loop_lag': move.max_loop_lag,
+            'max_handler_time': move.max_handler_time,
+            'first_callback_delay': move.first_callback,
+            'quality': 'skewed' if skewed else 'ok',
+        }
+
+    def on_lag(self, lag):
+        self.loop_lag.record(lag)
+        for move in self.moves:
+            if lag > move.max_loop_lag:
+                move.max_loop_lag = lag
+
+    def as_dict(self):
+        return {name: {**getattr(self, name).summary(), 'buckets': getattr(self, name).buckets()}
+                for name in ('handler', 'loop_lag', 'first_callback', 'persistence')}
+
+
+class Profiler:
+    """Instrumentation for a profiled sweep: one loop lag probe shared by all cameras
+
+    Loop lag is a property of the whole process; each camera's histogram
+    holds the lag samples taken while it had a move in flight.
+    """
+
+    def __init__(self, lag_interval=LAG_INTERVAL, threshold=QUALITY_THRESHOLD, cprofile=False):
+        self.threshold = threshold
+        self.cameras = {}
+        self.monitor = LoopLagMonitor(lag_interval, on_lag=self._on_lag)
+        self._cprofile = None
+        if cprofile:
+            import cProfile
+            self._cprofile = cProfile.Profile()
+
+    def camera(self, cam_id):
+        profile = self.cameras.get(cam_id)
+        if profile is None:
+            profile = self.cameras[cam_id] = CameraProfile(cam_id, self.threshold)
+        return profile
+
+    def _on_lag(self, lag):
+        for profile in self.cameras.values():
+            if profile.moves:
+                profile.on_lag(lag)
+
+    def start(self):
+        self.monitor.start()
+        if self._cprofile is not None:
+            self._cprofile.enable()
+        return self
+
+    async def stop(self):
+        if self._cprofile is not None:
+            self._cprofile.disable()
+        await self.monitor.stop()
+
+    def write(self, path=PROFILE_PATH, cprofile_path=None):
+        """Write every camera's histograms as JSON, and the cProfile stats if collected"""
+        report = {
+            'threshold': self.threshold,
+            'loop_lag': {**self.monitor.lag.summary(), 'buckets': self.monitor.lag.buckets()},
+            'cameras': {str(cam_id): profile.as_dict() for cam_id, profile in sorted(self.cameras.items())},
+        }
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+        if self._cprofile is not None and cprofile_path:
+            self._cprofile.dump_stats(cprofile_path)
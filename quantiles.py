@@ -0,0 +1,195 @@
+import argparse
+import bisect
+import glob
+import json
+import os
+
+from histogram import Histogram
+from movemodel import ALL_CAMERAS, RESULT_SOURCES, read_moves, read_timeouts
+from speedlookup import parse_move
+
+BOLD = "\033[1m"
+RESET = "\033[0m"
+
+QUANTILES_PATH = "quantiles.json"
+# Lower edges of the |delta pan| and |delta tilt| buckets, in degrees
+PAN_EDGES = (0.0, 2.0, 5.0, 10.0, 20.0, 40.0, 70.0, 100.0, 140.0)
+TILT_EDGES = (0.0, 2.0, 5.0, 10.0, 20.0, 40.0, 70.0)
+QUANTILES = (0.5, 0.9, 0.99)
+# Sketch layout: 2% relative error between 10 ms and 10 minutes
+LOWEST = 0.01
+HIGHEST = 600.0
+MIN_SAMPLES = 5
+
+
+def delta_bucket(delta_pan, delta_tilt):
+    """(pan bucket, tilt bucket) indices of a move"""
+    return (bisect.bisect_right(PAN_EDGES, abs(delta_pan)) - 1,
+            bisect.bisect_right(TILT_EDGES, abs(delta_tilt)) - 1)
+
+
+class QuantileModel:
+    """Mergeable move-time sketches per (camera, gimbal_speed, delta bucket)
+
+    Every cell is a log-bucketed Histogram, so any quantile is within 2% of
+    a recorded value and sketches from different runs or venues merge by
+    adding counts. Each move is also recorded under ALL_CAMERAS, the
+    fallback for cameras with too few moves in a cell.
+
+    Moves that timed out are censored: they took longer than their timeout,
+    by an unknown amount. They are kept in a second sketch per cell at their
+    timeout and count toward every rank, so a quantile whose rank falls
+    among them is unknown rather than biased low.
+    """
+
+    def __init__(self):
+        # (cam_id or ALL_CAMERAS, gimbal_speed, pan bucket, tilt bucket) -> Histogram
+        self.sketches = {}
+        self.censored = {}
+
+    def observe(self, cam_id, gimbal_speed, delta_pan, delta_tilt, execution_time, censored=False):
+        """Record a move time, or with `censored` the timeout a move did not complete within"""
+        cells = self.censored if censored else self.sketches
+        bucket = delta_bucket(delta_pan, delta_tilt)
+        for key in ((cam_id, gimbal_speed, *bucket), (ALL_CAMERAS, gimbal_speed, *bucket)):
+            sketch = cells.get(key)
+            if sketch is None:
+                sketch = cells[key] = Histogram(LOWEST, HIGHEST)
+            sketch.record(execution_time)
+
+    def load_results(self, patterns):
+        """Learn every move, outliers and recorded timeouts included, from results CSVs in either layout"""
+        for pattern in patterns:
+            for path in sorted(glob.glob(pattern)):
+                for move in read_moves(path, outliers=True):
+                    self.observe(*move)
+                for move in read_timeouts(path):
+                    self.observe(*move, censored=True)
+
+    def merge(self, other):
+        for mine, theirs in ((self.sketches, other.sketches), (self.censored, other.censored)):
+            for key, sketch in theirs.items():
+                cell = mine.get(key)
+                if cell is None:
+                    cell = mine[key] = Histogram(LOWEST, HIGHEST)
+                cell.merge(sketch)
+
+    def counts(self, key):
+        """(completed, timed out) moves in one cell"""
+        completed = self.sketches.get(key)
+        censored = self.censored.get(key)
+        return completed.count if completed else 0, censored.count if censored else 0
+
+    def cell(self, cam_id, gimbal_speed, delta_pan, delta_tilt, min_samples=MIN_SAMPLES):
+        """Key of the camera's cell for this move, else the all-camera one, None without enough moves"""
+        bucket = delta_bucket(delta_pan, delta_tilt)
+        for key in ((cam_id, gimbal_speed, *bucket), (ALL_CAMERAS, gimbal_speed, *bucket)):
+            if sum(self.counts(key)) >= min_samples:
+                return key
+        return None
+
+    def _quantile(self, key, q):
+        completed, censored = self.counts(key)
+        rank = q * (completed + censored)
+        if not completed or rank > completed:
+            return None
+        # Every timed-out move may be longer than this: the value bounds the true quantile from above
+        return self.sketches[key].percentile(rank / completed)
+
+    def quantile(self, cam_id, gimbal_speed, delta_pan, delta_tilt, q):
+        """q-quantile move time, None without enough moves or when its rank falls among timed-out moves"""
+        key = self.cell(cam_id, gimbal_speed, delta_pan, delta_tilt)
+        return None if key is None else self._quantile(key, q)
+
+    def quantiles(self, cam_id, gimbal_speed, delta_pan, delta_tilt, qs=QUANTILES):
+        """{'p50': seconds or None, ...} for this move, None without enough moves"""
+        key = self.cell(cam_id, gimbal_speed, delta_pan, delta_tilt)
+        if key is None:
+            return None
+        return {f"p{q * 100:g}": self._quantile(key, q) for q in qs}
+
+    def speeds(self):
+        return sorted({key[1] for key in self.sketches} | {key[1] for key in self.censored})
+
+    def slowest_speed(self, cam_id, delta_pan, delta_tilt, budget, q=0.99):
+        """Largest gimbal_speed whose q-quantile move time fits in `budget` seconds, None if none does
+
+        Lower gimbal_speed values are the faster settings. Speeds without
+        enough moves in this bucket, or whose q-quantile is unknown because
+        too many moves timed out, are not considered.
+        """
+        for gimbal_speed in reversed(self.speeds()):
+            predicted = self.quantile(cam_id, gimbal_speed, delta_pan, delta_tilt, q)
+            if predicted is not None and predicted <= budget:
+                return gimbal_speed
+        return None
+
+    def save(self, path=QUANTILES_PATH):
+        cells = []
+        for key in sorted(set(self.sketches) | set(self.censored), key=str):
+            completed = self.sketches.get(key)
+            censored = self.censored.get(key)
+            cells.append({'cam_id': key[0], 'gimbal_speed': key[1], 'pan_bucket': key[2], 'tilt_bucket': key[3],
+                          'sketch': completed.to_dict() if completed else None,
+                          'censored': censored.to_dict() if censored else None})
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'pan_edges': PAN_EDGES, 'tilt_edges': TILT_EDGES, 'cells': cells}, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=QUANTILES_PATH):
+        with open(path) as f:
+            data = json.load(f)
+        if tuple(data['pan_edges']) != PAN_EDGES or tuple(data['tilt_edges']) != TILT_EDGES:
+            raise ValueError(f"{path} uses different delta buckets")
+        model = cls()
+        for cell in data['cells']:
+            key = (cell['cam_id'], cell['gimbal_speed'], cell['pan_bucket'], cell['tilt_bucket'])
+            if cell.get('sketch'):
+                model.sketches[key] = Histogram.from_dict(cell['sketch'])
+            if cell.get('censored'):
+                model.censored[key] = Histogram.from_dict(cell['censored'])
+        return model
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Build, merge and query move-time quantile sketches per camera, speed and delta bucket")
+    parser.add_argument('sources', nargs='*', help="results CSVs (paths or globs), plan or venue layout "
+                                                   "(default: every result file, unless --merge is given)")
+    parser.add_argument('--merge', nargs='*', default=[], help="quantile files from other runs or venues to add")
+    parser.add_argument('-o', '--output', default=QUANTILES_PATH, help="merged quantile file to write")
+    parser.add_argument('--query', nargs='*', type=parse_move, default=[], metavar='CAM:PAN:TILT',
+                        help="moves to report p50/p90/p99 for")
+    parser.add_argument('--budget', type=float,
+                        help="with --query, also report the slowest speed whose tail fits in this many seconds")
+    parser.add_argument('--q', type=float, default=0.99, help="quantile the budget applies to")
+    args = parser.parse_args(argv)
+
+    model = QuantileModel()
+    for path in args.merge:
+        model.merge(QuantileModel.load(path))
+    if args.sources or not args.merge:
+        model.load_results(args.sources or RESULT_SOURCES)
+    model.save(args.output)
+    moves = sum(sketch.count for key, sketch in model.sketches.items() if key[0] == ALL_CAMERAS)
+    timeouts = sum(sketch.count for key, sketch in model.censored.items() if key[0] == ALL_CAMERAS)
+    cells = len(set(model.sketches) | set(model.censored))
+    print(f"{moves} moves and {timeouts} timeouts in {cells} cells written to {args.output}")
+
+    for cam_id, delta_pan, delta_tilt in args.query:
+        print(f"Camera {cam_id}: pan {delta_pan:+.1f}, tilt {delta_tilt:+.1f}")
+        for gimbal_speed in model.speeds():
+            quantiles = model.quantiles(cam_id, gimbal_speed, delta_pan, delta_tilt)
+            if quantiles is not None:
+                print(f"  speed {gimbal_speed}: " + ", ".join(
+                    f"{name} {'unknown' if value is None else f'{value:.2f} s'}" for name, value in quantiles.items()))
+        if args.budget is not None:
+            speed = model.slowest_speed(cam_id, delta_pan, delta_tilt, args.budget, args.q)
+            answer = 'none' if speed is None else speed
+            print(f"  slowest speed within {args.budget:.2f} s at p{args.q * 100:g}: {BOLD}{answer}{RESET}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+import json
+import mmap
+import os
+import time
+from array import array
+
+RECORDING_DIR = "recordings"
+INDEX_NAME = "index.jsonl"
+SEGMENT_MAGIC = b'GTTRAJ01'
+BUFFER_SAMPLES = 4096
+
+# A segment is one file per run: the magic header followed by one block per
+# move. A block holds `count` float64 timestamps (perf_counter seconds), then
+# `count` pan positions, then `count` raw tilt positions, so every column of a
+# move is contiguous and can be memory-mapped as a (3, count) array. The index
+# holds one JSON line per move with its run, camera, byte offset and count.
+
+
+class MoveBuffer:
+    """Preallocated sample columns for the move currently being recorded"""
+    __slots__ = ['t', 'pan', 'tilt', 'count', 'dropped', 'capacity', 'meta']
+
+    def __init__(self, capacity=BUFFER_SAMPLES):
+        self.capacity = capacity
+        self.t = array('d', bytes(8 * capacity))
+        self.pan = array('d', bytes(8 * capacity))
+        self.tilt = array('d', bytes(8 * capacity))
+        self.count = 0
+        self.dropped = 0
+        self.meta = None
+
+    def reset(self, meta):
+        self.count = 0
+        self.dropped = 0
+        self.meta = meta
+
+    def append(self, t, pan, tilt):
+        i = self.count
+        if i == self.capacity:
+            self.dropped += 1
+            return
+        self.t[i] = t
+        self.pan[i] = pan
+        self.tilt[i] = tilt
+        self.count = i + 1
+
+    def extend(self, t, pan, tilt):
+        """Append equal-length float64 columns (arrays, numpy arrays) in one copy each"""
+        i = self.count
+        k = min(len(t), self.capacity - i)
+        self.dropped += len(t) - k
+        for column, values in ((self.t, t), (self.pan, pan), (self.tilt, tilt)):
+            memoryview(column)[i:i + k] = memoryview(values)[:k]
+        self.count = i + k
+
+
+class TrajectoryRecorder:
+    """Appends every recorded move as a columnar block of this run's segment file"""
+
+    def __init__(self, directory=RECORDING_DIR, run_id=None, capacity=BUFFER_SAMPLES, io=None):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.run_id = run_id or time.strftime('%Y%m%d-%H%M%S')
+        self.capacity = capacity
+        self.segment = f"{self.run_id}.traj"
+        path = os.path.join(directory, self.segment)
+        self._segment = open(path, 'ab')
+        if self._segment.tell() == 0:
+            self._segment.write(SEGMENT_MAGIC)
+        self._offset = self._segment.tell()
+        self._index = open(os.path.join(directory, INDEX_NAME), 'a')
+        self.io = io
+        self.moves = 0
+
+    def buffer(self):
+        return MoveBuffer(self.capacity)
+
+    def write(self, buffer):
+        """Append the buffered move to the segment and index it
+
+        With an IOThread the block is copied out of the buffer, which can be
+        reused straight away, and written on the writer thread.
+        """
+        if buffer.meta is None:
+            return
+        count = buffer.count
+        offset = self._offset
+        entry = {'run': self.run_id, 'segment': self.segment, 'offset': offset,
+                 'count': count, 'dropped': buffer.dropped, **buffer.meta}
+        line = json.dumps(entry) + '\n'
+        self._offset += 24 * count
+        if self.io is not None:
+            block = b''.join(memoryview(column)[:count].tobytes() for column in (buffer.t, buffer.pan, buffer.tilt))
+            self.io.submit(self._append, (block,), line)
+        else:
+            self._append([memoryview(column)[:count] for column in (buffer.t, buffer.pan, buffer.tilt)], line)
+        buffer.meta = None
+        self.moves += 1
+
+    def _append(self, columns, line):
+        for column in columns:
+            self._segment.write(column)
+        self._segment.flush()
+        self._index.write(line)
+        self._index.flush()
+
+    def close(self):
+        self._segment.close()
+        self._index.close()
+
+
+def read_index(directory=RECORDING_DIR, cam_id=None, run=None):
+    """Index entries of every recorded move, optionally for one camera and/or run"""
+    entries = []
+    with open(os.path.join(directory, INDEX_NAME)) as f:
+        for line in f:
+            if not line.endswith('\n'):
+                break
+            entry = json.loads(line)
+            if cam_id is not None and entry['cam_id'] != cam_id:
+                continue
+            if run is not None and entry['run'] != run:
+                continue
+            entries.append(entry)
+    return entries
+
+
+class SegmentReader:
+    """Memory-maps segment files and hands out per-move column views without copying"""
+
+    def __init__(self, directory=RECORDING_DIR):
+        self.directory = directory
+        self._maps = {}
+
+    def _map(self, segment):
+        mapped = self._maps.get(segment)
+        if mapped is None:
+            with open(os.path.join(self.directory, segment), 'rb') as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            if mapped[:len(SEGMENT_MAGIC)] != SEGMENT_MAGIC:
+                raise ValueError(f"{segment} is not a trajectory segment")
+            self._maps[segment] = mapped
+        return mapped
+
+    def columns(self, entry):
+        """(t, pan, tilt) float64 memoryviews of one indexed move"""
+        count = entry['count']
+        data = memoryview(self._map(entry['segment']))[entry['offset']:entry['offset'] + 24 * count].cast('d')
+        return data[:count], data[count:2 * count], data[2 * count:]
+
+    def close(self):
+        for mapped in self._maps.values():
+            mapped.close()
+        self._maps.clear()
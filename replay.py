@@ -0,0 +1,205 @@
+import argparse
+import csv
+import os
+import time
+
+import numpy as np
+
+from recorder import RECORDING_DIR, SegmentReader, read_index
+from tracker import INTERPOLATION, MOVE_TIMEOUT, POSITION_TOLERANCE
+
+# each:    every axis has been inside tolerance at least once (the live rule)
+# both:    first sample with both axes inside tolerance together
+# settled: both axes inside tolerance and staying there for the rest of the recording
+CRITERIA = ('each', 'both', 'settled')
+RESULT_FIELDS = ['run', 'plan', 'row', 'cam_id', 'gimbal_speed', 'pan_setpoint', 'tilt_setpoint']
+
+
+class Recording:
+    """Every recorded move concatenated into flat columns, one slice per move"""
+
+    def __init__(self, directory=RECORDING_DIR, cam_id=None, run=None):
+        entries = [e for e in read_index(directory, cam_id=cam_id, run=run) if e['count'] > 0]
+        self.entries = entries
+        reader = SegmentReader(directory)
+        try:
+            columns = [[np.frombuffer(column, dtype=float) for column in reader.columns(entry)] for entry in entries]
+            t_parts = [t - entry['origin'] for (t, _, _), entry in zip(columns, entries)]
+            self.t = np.concatenate(t_parts) if entries else np.empty(0)
+            self.pan = np.concatenate([pan for _, pan, _ in columns]) if entries else np.empty(0)
+            self.tilt = np.concatenate([tilt for _, _, tilt in columns]) if entries else np.empty(0)
+        finally:
+            # The views into the segments have to go before they can be unmapped
+            columns = None
+            reader.close()
+
+        counts = np.array([e['count'] for e in entries], dtype=np.int64)
+        self.starts = np.concatenate(([0], np.cumsum(counts)))
+        self.move = np.repeat(np.arange(len(entries)), counts)
+        # Timeout each move ran with, NaN in recordings made before it was recorded
+        self.timeouts = np.array([np.nan if e.get('timeout') in (None, '') else e['timeout'] for e in entries],
+                                 dtype=float)
+
+        pan_setpoint = np.array([e['pan_setpoint'] for e in entries], dtype=float)
+        tilt_setpoint = np.array([e['tilt_setpoint'] for e in entries], dtype=float)
+        # Same tilt sign convention as MoveTracker.update
+        tilt_positive = (tilt_setpoint > 0)[self.move]
+        self.pan_signed = self.pan - pan_setpoint[self.move]
+        self.tilt_signed = np.where(tilt_positive, -self.tilt, self.tilt) - tilt_setpoint[self.move]
+        self.pan_error = np.abs(self.pan_signed)
+        self.tilt_error = np.abs(self.tilt_signed)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def move_timeouts(self, timeout=MOVE_TIMEOUT):
+        """Per-move timeouts as recorded, `timeout` for moves that did not record one"""
+        return np.where(np.isnan(self.timeouts), timeout, self.timeouts)
+
+    def _live(self, timeout):
+        # Samples the live tracker saw: after the command and before the move's own timeout
+        return (self.t >= 0) & (self.t <= self.move_timeouts(timeout)[self.move])
+
+    def _crossing(self, first, signed, tolerances, heads, method='linear'):
+        # tracker.crossing_time for every (tolerance, move) at once, over the same (at most 4)
+        # samples ending at the first one inside tolerance that the live tracker kept
+        n = len(self.t)
+        window = np.maximum(np.minimum(first, n - 1)[..., None] + np.arange(-3, 1), 0)
+        times = self.t[window]
+        errors = signed[window]
+        kept = ((window >= heads[:, None]) & (times >= 0)).sum(axis=-1)
+        t1, t2 = times[..., 2], times[..., 3]
+        e1, e2 = errors[..., 2], errors[..., 3]
+        bound = np.where(e1 > 0, tolerances, -tolerances)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            crossing = t1 + (e1 - bound) / (e1 - e2) * (t2 - t1)
+        usable = (kept >= 2) & (e1 != e2) & (t2 > t1)
+        crossing = np.where(usable, crossing, t2)
+        if method != 'cubic':
+            return crossing
+
+        # Bisection along the Lagrange cubic through all four samples, all pairs in step
+        cubic = usable & (kept == 4) & (np.diff(times, axis=-1) > 0).all(axis=-1)
+        times, errors, bound = times[cubic], errors[cubic], bound[cubic]
+        others = np.array([[j for j in range(4) if j != i] for i in range(4)])
+        spans = times[:, :, None] - times[:, others]
+        weights = errors / spans.prod(axis=-1)
+
+        def value(x):
+            return (weights * (x[:, None, None] - times[:, others]).prod(axis=-1)).sum(axis=-1) - bound
+
+        low, high = times[:, 2].copy(), times[:, 3].copy()
+        low_sign = errors[:, 2] - bound > 0
+        for _ in range(30):
+            mid = 0.5 * (low + high)
+            below = (value(mid) > 0) == low_sign
+            low = np.where(below, mid, low)
+            high = np.where(below, high, mid)
+        crossing[cubic] = 0.5 * (low + high)
+        return crossing
+
+    def completion_times(self, tolerances, criterion='each', timeout=MOVE_TIMEOUT, interpolation='none'):
+        """(len(tolerances), moves) array of completion times, NaN where never completed
+
+        Each move is cut off at the timeout it ran with, `timeout` for
+        recordings that did not store one. With `interpolation` 'linear' or
+        'cubic', the 'each' rule places every axis's crossing between samples
+        as the live tracker does (see tracker.crossing_time).
+        """
+        if interpolation not in INTERPOLATION:
+            raise ValueError(f"Unknown interpolation {interpolation!r}, expected one of {INTERPOLATION}")
+        tolerances = np.asarray(tolerances, dtype=float)[:, None]
+        n = len(self.t)
+        index = np.arange(n)
+        heads = self.starts[:-1]
+        ends = self.starts[1:]
+        live = self._live(timeout)
+
+        pan_in = (self.pan_error <= tolerances) & live
+        tilt_in = (self.tilt_error <= tolerances) & live
+        if criterion == 'each':
+            first_pan = np.minimum.reduceat(np.where(pan_in, index, n), heads, axis=1)
+            first_tilt = np.minimum.reduceat(np.where(tilt_in, index, n), heads, axis=1)
+            done = np.maximum(first_pan, first_tilt)
+            if interpolation != 'none':
+                reached = done < ends
+                crossing = np.maximum(self._crossing(first_pan, self.pan_signed, tolerances, heads, interpolation),
+                                      self._crossing(first_tilt, self.tilt_signed, tolerances, heads, interpolation))
+                return np.where(reached, np.maximum(crossing, 0.0), np.nan)
+        elif criterion == 'both':
+            done = np.minimum.reduceat(np.where(pan_in & tilt_in, index, n), heads, axis=1)
+        elif criterion == 'settled':
+            inside = (self.pan_error <= tolerances) & (self.tilt_error <= tolerances)
+            last_out = np.maximum.reduceat(np.where(inside, -1, index), heads, axis=1)
+            done = np.maximum(last_out + 1, heads)
+            done = np.where(self.t[np.minimum(done, n - 1)] <= self.move_timeouts(timeout), done, n)
+        else:
+            raise ValueError(f"Unknown criterion {criterion!r}, expected one of {CRITERIA}")
+
+        reached = done < ends
+        return np.where(reached, np.maximum(self.t[np.minimum(done, n - 1)], 0.0), np.nan)
+
+    def axis_times(self, tolerance=POSITION_TOLERANCE, timeout=MOVE_TIMEOUT):
+        """(pan, tilt) arrays of when each axis first came within tolerance, NaN where it never did"""
+        n = len(self.t)
+        index = np.arange(n)
+        heads = self.starts[:-1]
+        ends = self.starts[1:]
+        live = self._live(timeout)
+        times = []
+        for error in (self.pan_error, self.tilt_error):
+            first = np.minimum.reduceat(np.where((error <= tolerance) & live, index, n), heads)
+            times.append(np.where(first < ends, np.maximum(self.t[np.minimum(first, n - 1)], 0.0), np.nan))
+        return times
+
+    def write_results(self, path, times):
+        with open(path, 'w', newline='') as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(RESULT_FIELDS + ['execution_time'])
+            for entry, value in zip(self.entries, times):
+                writer.writerow([entry.get(field, '') for field in RESULT_FIELDS]
+                                + ['' if np.isnan(value) else value])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Re-score recorded moves under other tolerances and completion criteria")
+    parser.add_argument('directory', nargs='?', default=RECORDING_DIR, help="recording directory")
+    parser.add_argument('--tolerance', type=float, nargs='+', default=[POSITION_TOLERANCE],
+                        help="position tolerances in degrees to evaluate")
+    parser.add_argument('--criterion', nargs='+', choices=CRITERIA, default=['each'],
+                        help="completion rules to evaluate")
+    parser.add_argument('--timeout', type=float, default=MOVE_TIMEOUT,
+                        help="ignore samples later than this after the command, for moves recorded "
+                             "without their own timeout")
+    parser.add_argument('--interpolation', choices=INTERPOLATION, default='cubic',
+                        help="how crossing instants are placed between samples (criterion 'each'), "
+                             "as in sweep.py")
+    parser.add_argument('--cam-id', type=int, help="only replay this camera")
+    parser.add_argument('--run', help="only replay this run")
+    parser.add_argument('--out', default='replay', help="directory for one results CSV per setting")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    recording = Recording(args.directory, cam_id=args.cam_id, run=args.run)
+    print(f"Loaded {len(recording)} moves, {len(recording.t)} samples "
+          f"in {time.perf_counter() - start:.2f} Seconds")
+
+    os.makedirs(args.out, exist_ok=True)
+    for criterion in args.criterion:
+        times = recording.completion_times(args.tolerance, criterion, timeout=args.timeout,
+                                           interpolation=args.interpolation)
+        for tolerance, row in zip(args.tolerance, times):
+            path = os.path.join(args.out, f"replay_{criterion}_tol{tolerance:g}.csv")
+            recording.write_results(path, row)
+            reached = row[~np.isnan(row)]
+            if len(reached):
+                summary = f"mean {reached.mean():.3f} s, median {np.median(reached):.3f} s"
+            else:
+                summary = "no moves completed"
+            print(f"{criterion:>8} tol {tolerance:<6g} {len(reached):>5}/{len(row)} completed, {summary} -> {path}")
+    print(f"Replay finished in {time.perf_counter() - start:.2f} Seconds")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+from array import array
+
+SETTLE_WINDOW = 0.5
+SETTLE_VARIANCE = 0.0025
+SETTLE_MIN_SAMPLES = 4
+
+
+class SettleDetector:
+    """Flags a gimbal at rest once position variance over a sliding time window is small
+
+    Samples live in fixed ring buffers with running sums, so each update is
+    O(1) and allocates nothing.
+    """
+    __slots__ = ['window', 'threshold', 'min_samples', 'capacity', '_t', '_pan', '_tilt',
+                 '_head', '_count', '_ref_pan', '_ref_tilt', '_sum_pan', '_sum_tilt',
+                 '_sq_pan', '_sq_tilt', 'settled']
+
+    def __init__(self, window=SETTLE_WINDOW, threshold=SETTLE_VARIANCE,
+                 min_samples=SETTLE_MIN_SAMPLES, capacity=512):
+        self.window = window
+        self.threshold = threshold
+        self.min_samples = min_samples
+        self.capacity = capacity
+        self._t = array('d', bytes(8 * capacity))
+        self._pan = array('d', bytes(8 * capacity))
+        self._tilt = array('d', bytes(8 * capacity))
+        self.reset()
+
+    def reset(self):
+        self._head = 0
+        self._count = 0
+        self._ref_pan = None
+        self._ref_tilt = 0.0
+        self._sum_pan = self._sum_tilt = 0.0
+        self._sq_pan = self._sq_tilt = 0.0
+        self.settled = False
+
+    def _evict(self):
+        tail = (self._head - self._count) % self.capacity
+        pan = self._pan[tail]
+        tilt = self._tilt[tail]
+        self._sum_pan -= pan
+        self._sum_tilt -= tilt
+        self._sq_pan -= pan * pan
+        self._sq_tilt -= tilt * tilt
+        self._count -= 1
+
+    def _resum(self):
+        # Rebuild the running sums once per lap of the ring so rounding cannot accumulate
+        self._sum_pan = self._sum_tilt = self._sq_pan = self._sq_tilt = 0.0
+        for i in range(self._head - self._count, self._head):
+            pan = self._pan[i % self.capacity]
+            tilt = self._tilt[i % self.capacity]
+            self._sum_pan += pan
+            self._sum_tilt += tilt
+            self._sq_pan += pan * pan
+            self._sq_tilt += tilt * tilt
+
+    def update(self, t, pan, tilt):
+        """Add one sample and return whether the gimbal is currently at rest"""
+        if self._ref_pan is None:
+            self._ref_pan = pan
+            self._ref_tilt = tilt
+        # Sums are kept relative to the first sample to limit cancellation error
+        pan -= self._ref_pan
+        tilt -= self._ref_tilt
+
+        if self._count == self.capacity:
+            self._evict()
+        head = self._head
+        self._t[head] = t
+        self._pan[head] = pan
+        self._tilt[head] = tilt
+        self._head = (head + 1) % self.capacity
+        self._count += 1
+        if self._head == 0:
+            self._resum()
+        else:
+            self._sum_pan += pan
+            self._sum_tilt += tilt
+            self._sq_pan += pan * pan
+            self._sq_tilt += tilt * tilt
+
+        while self._count > 1 and t - self._t[(self._head - self._count) % self.capacity] > self.window:
+            self._evict()
+
+        n = self._count
+        span = t - self._t[(self._head - n) % self.capacity]
+        if n < self.min_samples or span < 0.5 * self.window:
+            self.settled = False
+        else:
+            pan_mean = self._sum_pan / n
+            tilt_mean = self._sum_tilt / n
+            pan_variance = self._sq_pan / n - pan_mean * pan_mean
+            tilt_variance = self._sq_tilt / n - tilt_mean * tilt_mean
+            self.settled = pan_variance <= self.threshold and tilt_variance <= self.threshold
+        return self.settled
@@ -0,0 +1,426 @@
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+
+from nats.errors import SlowConsumerError
+
+from connection import NATS_URL, connect
+from decoder import encode_position
+from loops import LOOPS, run
+
+# gimbal_speed -> (dead time s, max velocity deg/s, acceleration deg/s^2).
+# Lower gimbal_speed values are the faster settings on our cameras.
+SPEED_PROFILES = {
+    1: (0.30, 30.0, 120.0),
+    2: (0.60, 29.0, 110.0),
+    3: (1.00, 28.0, 100.0),
+    4: (1.50, 27.0, 90.0),
+    5: (1.90, 26.0, 80.0),
+    6: (2.40, 24.0, 70.0),
+    7: (2.80, 22.0, 60.0),
+    8: (3.30, 21.0, 50.0),
+}
+ENCODINGS = ('json', 'binary')
+TILT_VELOCITY_SCALE = 0.5
+PUBLISH_RATE = 20.0
+POSITION_NOISE = 0.02
+CAMERA_SPREAD = 0.1
+POSITION_TOLERANCE = 0.1
+
+
+def trapezoid_time(distance, v_max, accel):
+    """Time to travel `distance` from rest to rest under a trapezoidal velocity profile"""
+    distance = abs(distance)
+    if distance <= v_max * v_max / accel:
+        return 2 * math.sqrt(distance / accel)
+    return v_max / accel + distance / v_max
+
+
+def model_move_time(gimbal_speed, delta_pan, delta_tilt, profiles=SPEED_PROFILES):
+    """Noise-free move time of the nominal simulated gimbal, dead time included"""
+    speeds = sorted(profiles)
+    dead, v_max, accel = profiles[min(max(gimbal_speed, speeds[0]), speeds[-1])]
+    return dead + max(trapezoid_time(delta_pan, v_max, accel),
+                      trapezoid_time(delta_tilt, v_max * TILT_VELOCITY_SCALE, accel * TILT_VELOCITY_SCALE))
+
+
+class LocalMsg:
+    __slots__ = ['subject', 'data', 'reply']
+
+    def __init__(self, subject, data, reply=''):
+        self.subject = subject
+        self.data = data
+        self.reply = reply
+
+
+class LocalSubscription:
+    """Subscription handed out by LocalNATS, delivering in order like nats-py"""
+
+    def __init__(self, broker, subject, cb=None, pending_msgs_limit=65536, pending_bytes_limit=64 * 1024 * 1024):
+        self._broker = broker
+        self.subject = subject
+        self._tokens = subject.split('.')
+        self._cb = cb
+        self._pending_msgs_limit = pending_msgs_limit
+        self._pending_bytes_limit = pending_bytes_limit
+        self._pending_size = 0
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._wait_for_msgs()) if cb is not None else None
+        self.delivered = 0
+        self.dropped = 0
+
+    def matches(self, subject):
+        tokens = subject.split('.')
+        for i, token in enumerate(self._tokens):
+            if token == '>':
+                return len(tokens) > i
+            if i >= len(tokens) or (token != '*' and token != tokens[i]):
+                return False
+        return len(tokens) == len(self._tokens)
+
+    @property
+    def pending_msgs(self):
+        return self._queue.qsize()
+
+    @property
+    def pending_bytes(self):
+        return self._pending_size
+
+    def _deliver(self, msg):
+        if (self._queue.qsize() >= self._pending_msgs_limit
+                or self._pending_size + len(msg.data) > self._pending_bytes_limit):
+            self.dropped += 1
+            self._broker._slow_consumer(self, msg)
+            return
+        self._pending_size += len(msg.data)
+        self._queue.put_nowait(msg)
+
+    async def _wait_for_msgs(self):
+        while True:
+            msg = await self._queue.get()
+            self._pending_size -= len(msg.data)
+            self.delivered += 1
+            try:
+                await self._cb(msg)
+            except Exception as e:
+                self._broker.log(f"Error in callback for {self.subject}: {e}")
+
+    async def next_msg(self, timeout=1.0):
+        msg = await asyncio.wait_for(self._queue.get(), timeout)
+        self._pending_size -= len(msg.data)
+        self.delivered += 1
+        return msg
+
+    async def unsubscribe(self):
+        self._broker._remove(self)
+        if self._task is not None:
+            self._task.cancel()
+
+
+class LocalNATS:
+    """In-process stand-in for nats.aio.client.Client, for runs without a server"""
+
+    def __init__(self, log=print):
+        self._subscriptions = []
+        self._routes = {}
+        self._error_cb = None
+        self.is_connected = False
+        self.log = log
+
+    async def connect(self, servers=None, error_cb=None, **options):
+        self._error_cb = error_cb
+        self.is_connected = True
+
+    async def subscribe(self, subject, cb=None, pending_msgs_limit=65536, pending_bytes_limit=64 * 1024 * 1024,
+                        **options):
+        subscription = LocalSubscription(self, subject, cb, pending_msgs_limit, pending_bytes_limit)
+        self._subscriptions.append(subscription)
+        self._routes.clear()
+        return subscription
+
+    def _remove(self, subscription):
+        if subscription in self._subscriptions:
+            self._subscriptions.remove(subscription)
+            self._routes.clear()
+
+    def _slow_consumer(self, subscription, msg):
+        # Reported like nats-py does, through the error callback
+        if self._error_cb is not None:
+            asyncio.create_task(self._error_cb(SlowConsumerError(msg.subject, msg.reply, 0, subscription)))
+
+    async def publish(self, subject, payload=b'', reply='', headers=None):
+        route = self._routes.get(subject)
+        if route is None:
+            route = [s for s in self._subscriptions if s.matches(subject)]
+            self._routes[subject] = route
+        if route:
+            msg = LocalMsg(subject, payload, reply)
+            for subscription in route:
+                subscription._deliver(msg)
+
+    async def flush(self, timeout=10):
+        await asyncio.sleep(0)
+
+    async def drain(self):
+        await self.close()
+
+    async def close(self):
+        for subscription in list(self._subscriptions):
+            await subscription.unsubscribe()
+        self.is_connected = False
+
+
+class Axis:
+    """One gimbal axis following a trapezoidal velocity profile"""
+    __slots__ = ['start', 'target', 't_begin', 'accel', 'v_peak', 't_accel', 't_total']
+
+    def __init__(self, position=0.0):
+        self.start = position
+        self.target = position
+        self.t_begin = 0.0
+        self.accel = 1.0
+        self.v_peak = 0.0
+        self.t_accel = 0.0
+        self.t_total = 0.0
+
+    def command(self, target, t_begin, v_max, accel, now):
+        # A new command restarts the profile from wherever the axis is now
+        self.start = self.position_at(now)
+        self.target = target
+        self.t_begin = t_begin
+        self.accel = accel
+        distance = abs(target - self.start)
+        if distance <= v_max * v_max / accel:
+            self.t_accel = math.sqrt(distance / accel)
+            self.v_peak = accel * self.t_accel
+            self.t_total = 2 * self.t_accel
+        else:
+            self.t_accel = v_max / accel
+            self.v_peak = v_max
+            self.t_total = 2 * self.t_accel + (distance - v_max * self.t_accel) / v_max
+
+    def travelled(self, s):
+        if s <= 0:
+            return 0.0
+        if s >= self.t_total:
+            return abs(self.target - self.start)
+        if s < self.t_accel:
+            return 0.5 * self.accel * s * s
+        left = self.t_total - s
+        if left < self.t_accel:
+            return abs(self.target - self.start) - 0.5 * self.accel * left * left
+        return 0.5 * self.v_peak * self.t_accel + self.v_peak * (s - self.t_accel)
+
+    def position_at(self, t):
+        direction = 1.0 if self.target >= self.start else -1.0
+        return self.start + direction * self.travelled(t - self.t_begin)
+
+    def arrival(self, tolerance):
+        """Time at which the axis first comes within tolerance of its target"""
+        distance = abs(self.target - self.start)
+        if distance <= tolerance:
+            return None
+        low, high = 0.0, self.t_total
+        for _ in range(40):
+            mid = 0.5 * (low + high)
+            if distance - self.travelled(mid) > tolerance:
+                low = mid
+            else:
+                high = mid
+        return self.t_begin + high
+
+
+class SimGimbal:
+    """A simulated PTZ head answering ptzcontrol with ptzinfo telemetry"""
+
+    def __init__(self, cam_id, profiles=SPEED_PROFILES, noise=POSITION_NOISE, tilt_sign=1,
+                 spread=CAMERA_SPREAD, seed=0, tilt_profiles=None):
+        self.cam_id = cam_id
+        self.noise = noise
+        self.tilt_sign = tilt_sign
+        self.rng = random.Random(seed * 1000 + cam_id)
+        scale = 1.0 + self.rng.uniform(-spread, spread)
+        self.profiles = {speed: (dead * scale, v_max / scale, accel / scale)
+                         for speed, (dead, v_max, accel) in profiles.items()}
+        if tilt_profiles is None:
+            # Tilt shares the pan profile at TILT_VELOCITY_SCALE of its velocity and acceleration
+            tilt_profiles = {speed: (dead, v_max * TILT_VELOCITY_SCALE, accel * TILT_VELOCITY_SCALE)
+                             for speed, (dead, v_max, accel) in profiles.items()}
+        self.tilt_profiles = {speed: (dead * scale, v_max / scale, accel / scale)
+                              for speed, (dead, v_max, accel) in tilt_profiles.items()}
+        self.pan = Axis()
+        self.tilt = Axis()
+        self.moves = []
+
+    @staticmethod
+    def _lookup(profiles, gimbal_speed):
+        if gimbal_speed in profiles:
+            return profiles[gimbal_speed]
+        speeds = sorted(profiles)
+        return profiles[min(max(gimbal_speed, speeds[0]), speeds[-1])]
+
+    def profile(self, gimbal_speed):
+        return self._lookup(self.profiles, gimbal_speed)
+
+    def command(self, data, now):
+        gimbal_speed = int(data.get('gimbal_speed', 1))
+        if 'pansetpoint' in data:
+            dead, v_max, accel = self.profile(gimbal_speed)
+            self.pan.command(float(data['pansetpoint']), now + dead, v_max, accel, now)
+        if 'tiltsetpoint' in data:
+            # The head reports tilt in its own sign convention
+            target = self.tilt_sign * float(data['tiltsetpoint'])
+            dead, v_max, accel = self._lookup(self.tilt_profiles, gimbal_speed)
+            self.tilt.command(target, now + dead, v_max, accel, now)
+        arrivals = [t for t in (self.pan.arrival(POSITION_TOLERANCE),
+                                self.tilt.arrival(POSITION_TOLERANCE)) if t is not None]
+        self.moves.append((now, max(arrivals) if arrivals else now))
+
+    def sample(self, now):
+        pan = self.pan.position_at(now)
+        tilt = self.tilt.position_at(now)
+        if self.noise:
+            pan += self.rng.gauss(0.0, self.noise)
+            tilt += self.rng.gauss(0.0, self.noise)
+        return pan, tilt
+
+    def true_times(self):
+        """Noise-free command-to-arrival time of every move received so far"""
+        return [arrival - received for received, arrival in self.moves]
+
+
+class SimFleet:
+    """Any number of simulated gimbals sharing one client and one publish loop"""
+
+    def __init__(self, nc, cam_ids, rate=PUBLISH_RATE, encoding='json', calibration=None, log=print,
+                 **gimbal_options):
+        if encoding not in ENCODINGS:
+            raise ValueError(f"Unknown encoding {encoding!r}, expected one of {ENCODINGS}")
+        self.nc = nc
+        self.log = log
+        self.rate = rate
+        self.binary = encoding == 'binary'
+        self.gimbals = {cam_id: SimGimbal(cam_id, **gimbal_options, **self._calibrated(calibration, cam_id))
+                        for cam_id in cam_ids}
+        self.published = 0
+        self._subscription = None
+        self._task = None
+
+    @staticmethod
+    def _calibrated(calibration, cam_id):
+        # Fitted profiles replace the nominal ones and the random per-camera spread
+        if calibration is None:
+            return {}
+        options = {'spread': 0.0}
+        pan = calibration.profiles(cam_id, 'pan')
+        tilt = calibration.profiles(cam_id, 'tilt')
+        if pan:
+            options['profiles'] = pan
+        if tilt:
+            options['tilt_profiles'] = tilt
+        return options
+
+    async def start(self):
+        self._subscription = await self.nc.subscribe("ptzcontrol.*", cb=self._control_handler)
+        self._task = asyncio.create_task(self._publish_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+        if self._subscription is not None:
+            await self._subscription.unsubscribe()
+
+    async def _control_handler(self, msg):
+        now = time.perf_counter()
+        try:
+            cam_id = int(msg.subject.rsplit('camera', 1)[1])
+            data = json.loads(msg.data.decode())
+        except (IndexError, ValueError) as e:
+            self.log(f"Error processing control message: {e}")
+            return
+        gimbal = self.gimbals.get(cam_id)
+        if gimbal is not None:
+            gimbal.command(data, now)
+
+    async def _publish_loop(self):
+        loop = asyncio.get_running_loop()
+        period = 1.0 / self.rate
+        binary = self.binary
+        next_tick = loop.time()
+        while True:
+            now = time.perf_counter()
+            for cam_id, gimbal in self.gimbals.items():
+                pan, tilt = gimbal.sample(now)
+                await self.nc.publish(f"ptzinfo.camera{cam_id}", encode_position(pan, tilt, binary))
+            self.published += len(self.gimbals)
+            next_tick += period
+            await asyncio.sleep(max(0.0, next_tick - loop.time()))
+
+    def accuracy(self, cam_id, measured):
+        """Bias and mean absolute error of measured move times against the model"""
+        pairs = [(m, t) for m, t in zip(measured, self.gimbals[cam_id].true_times()) if m is not None]
+        if not pairs:
+            return 0, 0.0, 0.0
+        errors = [m - t for m, t in pairs]
+        return len(errors), sum(errors) / len(errors), sum(abs(e) for e in errors) / len(errors)
+
+
+async def start_simulation(cam_ids, rate=PUBLISH_RATE, encoding='json', error_cb=None, log=print,
+                           **gimbal_options):
+    """An in-process broker with a running fleet, standing in for a NATS connection
+
+    Callback errors go to `log`, e.g. IOThread.print to keep them off the loop thread.
+    """
+    nc = LocalNATS(log)
+    await nc.connect(error_cb=error_cb)
+    fleet = SimFleet(nc, cam_ids, rate=rate, encoding=encoding, log=log, **gimbal_options)
+    await fleet.start()
+    return nc, fleet
+
+
+async def main(args):
+    calibration = None
+    if args.calibration:
+        # Imported here: calibration.py itself builds on this module
+        from calibration import Calibration
+        calibration = Calibration.load(args.calibration)
+    nc = await connect(args.server)
+    fleet = SimFleet(nc, args.cameras, rate=args.rate, encoding=args.encoding, noise=args.noise,
+                     tilt_sign=args.tilt_sign, seed=args.seed, calibration=calibration)
+    await fleet.start()
+    print(f"Simulating cameras {', '.join(map(str, args.cameras))} at {args.rate:.0f} Hz on {args.server}")
+    try:
+        while True:
+            await asyncio.sleep(1)
+    finally:
+        await fleet.stop()
+        await nc.drain()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Simulated gimbal fleet speaking ptzcontrol/ptzinfo")
+    parser.add_argument('cameras', nargs='+', type=int, help="camera ids to simulate")
+    parser.add_argument('--server', default=NATS_URL, help="NATS server url")
+    parser.add_argument('--rate', type=float, default=PUBLISH_RATE, help="telemetry rate per camera in Hz")
+    parser.add_argument('--encoding', choices=ENCODINGS, default='json',
+                        help="ptzinfo payload encoding (binary: two little-endian float64s, pan then tilt)")
+    parser.add_argument('--noise', type=float, default=POSITION_NOISE, help="position noise sigma in degrees")
+    parser.add_argument('--tilt-sign', type=int, choices=(1, -1), default=1,
+                        help="sign the head applies to tilt setpoints and reports")
+    parser.add_argument('--loop', choices=LOOPS, default='auto',
+                        help="event loop backend (auto: uvloop when installed)")
+    parser.add_argument('--seed', type=int, default=0, help="seed for per-camera variation and noise")
+    parser.add_argument('--calibration', help="coefficient table from calibration.py to move each camera by "
+                                              "instead of the nominal profiles")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    try:
+        args = parse_args()
+        run(main(args), args.loop)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,125 @@
+import argparse
+import bisect
+import math
+
+import numpy as np
+
+from movemodel import ALL_CAMERAS, MODEL_PATH, MoveModel
+
+BOLD = "\033[1m"
+RESET = "\033[0m"
+
+# Extent and resolution of the tables, in degrees of |delta pan| / |delta tilt|
+PAN_MAX = 180.0
+TILT_MAX = 90.0
+STEP = 1.0
+UNREACHABLE = -1
+
+
+class SpeedTable:
+    """Slowest gimbal_speed that completes a move within a deadline, by binary search
+
+    Built once from a MoveModel: predicted times on a grid of |delta pan| x
+    |delta tilt| for every camera and measured speed. The tables are made
+    monotone (never faster for a longer move or a slower speed setting) and
+    looked up at the grid cell above the query, so an answer never promises
+    less time than the model does. Lower gimbal_speed values are the faster
+    settings, so the slowest speed in time is the largest one.
+    """
+
+    def __init__(self, model, pan_max=PAN_MAX, tilt_max=TILT_MAX, step=STEP):
+        self.step = step
+        self.speeds = sorted({speed for _, speed in model.curves})
+        cam_ids = sorted({cam for cam, _ in model.curves if cam != ALL_CAMERAS})
+        self._index = {cam_id: i for i, cam_id in enumerate(cam_ids)}
+        # Cameras without curves of their own use the pooled tables in the last slot
+        self._pooled = len(cam_ids)
+
+        pan = np.arange(0.0, pan_max + step, step)
+        tilt = np.arange(0.0, tilt_max + step, step)
+        times = np.full((len(cam_ids) + 1, len(pan), len(tilt), len(self.speeds)), np.inf)
+        for k, cam_id in enumerate(cam_ids + [ALL_CAMERAS]):
+            for s, speed in enumerate(self.speeds):
+                predicted = model.predict_many(cam_id, speed, pan[:, None], tilt[None, :])
+                if predicted is not None:
+                    times[k, :, :, s] = predicted
+        for axis in (1, 2, 3):
+            np.maximum.accumulate(times, axis=axis, out=times)
+        # Finite so that rows can be laid end to end for the batch search
+        self._span = float(np.max(times[np.isfinite(times)], initial=0.0)) + 1.0
+        times[~np.isfinite(times)] = self._span - 1.0
+        self.times = times
+
+    def _cell(self, delta, cells):
+        i = math.ceil(abs(delta) / self.step - 1e-9)
+        if i >= cells:
+            raise ValueError(f"Move of {delta} degrees is beyond the table ({(cells - 1) * self.step} degrees)")
+        return i
+
+    def _cells(self, deltas, cells):
+        i = np.ceil(np.abs(deltas) / self.step - 1e-9).astype(int)
+        if i.size and i.max() >= cells:
+            raise ValueError(f"Move of {np.abs(deltas).max()} degrees is beyond the table "
+                             f"({(cells - 1) * self.step} degrees)")
+        return i
+
+    def predicted_times(self, cam_id, delta_pan, delta_tilt):
+        """Table move time at every speed in self.speeds, fastest setting first"""
+        _, pan_cells, tilt_cells, _ = self.times.shape
+        return self.times[self._index.get(cam_id, self._pooled),
+                          self._cell(delta_pan, pan_cells), self._cell(delta_tilt, tilt_cells)]
+
+    def slowest_speed(self, cam_id, delta_pan, delta_tilt, deadline):
+        """Largest gimbal_speed predicted to finish within `deadline` seconds, None if none does"""
+        i = bisect.bisect_right(self.predicted_times(cam_id, delta_pan, delta_tilt), deadline) - 1
+        return self.speeds[i] if i >= 0 else None
+
+    def slowest_speeds(self, cam_ids, delta_pan, delta_tilt, deadlines):
+        """Vectorized slowest_speed over arrays, UNREACHABLE where no speed is fast enough"""
+        _, pan_cells, tilt_cells, n_speeds = self.times.shape
+        index = np.array([self._index.get(int(cam_id), self._pooled) for cam_id in cam_ids], dtype=int)
+        rows = self.times[index, self._cells(delta_pan, pan_cells), self._cells(delta_tilt, tilt_cells)]
+        # One binary search over all rows laid end to end, row j shifted by j * span
+        offsets = np.arange(len(rows)) * self._span
+        deadlines = np.clip(np.asarray(deadlines, dtype=float), -0.5, self._span - 0.5)
+        position = np.searchsorted((rows + offsets[:, None]).ravel(), deadlines + offsets, side='right')
+        i = position - np.arange(len(rows)) * n_speeds - 1
+        speeds = np.asarray(self.speeds)
+        return np.where(i >= 0, speeds[np.maximum(i, 0)], UNREACHABLE)
+
+
+def parse_move(text):
+    """CAM:PAN:TILT -> (cam_id, delta_pan, delta_tilt)"""
+    try:
+        cam_id, delta_pan, delta_tilt = text.split(':')
+        return int(cam_id), float(delta_pan), float(delta_tilt)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected CAM:PAN:TILT, got {text!r}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Slowest gimbal_speed that gets each camera through its move within a deadline")
+    parser.add_argument('moves', nargs='+', type=parse_move, metavar='CAM:PAN:TILT',
+                        help="camera id and the delta pan / delta tilt it has to move, in degrees")
+    parser.add_argument('--deadline', type=float, required=True, help="seconds every camera has to arrive")
+    parser.add_argument('--model', default=MODEL_PATH, help="fitted move-time model (see movemodel.py)")
+    parser.add_argument('--step', type=float, default=STEP, help="table resolution in degrees")
+    args = parser.parse_args(argv)
+
+    table = SpeedTable(MoveModel.load(args.model), step=args.step)
+    cam_ids, delta_pan, delta_tilt = (np.array(column) for column in zip(*args.moves))
+    speeds = table.slowest_speeds(cam_ids, delta_pan, delta_tilt, np.full(len(cam_ids), args.deadline))
+    for cam_id, dp, dt, speed in zip(cam_ids, delta_pan, delta_tilt, speeds):
+        if speed == UNREACHABLE:
+            fastest = table.predicted_times(cam_id, dp, dt)[0]
+            print(f"Camera {cam_id}: pan {dp:+.1f}, tilt {dt:+.1f}: {BOLD}no speed in time{RESET} "
+                  f"(fastest predicted {fastest:.2f} s)")
+            continue
+        predicted = table.predicted_times(cam_id, dp, dt)[table.speeds.index(speed)]
+        print(f"Camera {cam_id}: pan {dp:+.1f}, tilt {dt:+.1f}: gimbal_speed {BOLD}{speed}{RESET} "
+              f"(predicted {predicted:.2f} s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,352 @@
+import argparse
+import asyncio
+import os
+import time
+from functools import partial
+
+from calibration import Calibration
+from connection import NATS_URL, SlowConsumerStats, connect
+from dashboard import MODES, REFRESH_INTERVAL, Dashboard
+from decoder import DECODERS, DEFAULT_DECODER
+from iothread import IOThread
+from journal import JOURNAL_PATH, Journal, compact, export, load_state
+from loopmon import LAG_INTERVAL, LoopLagMonitor
+from loops import LOOPS, run
+from movemodel import MODEL_PATH, MoveModel
+from plan import Plan, plan_path
+from profiling import PROFILE_PATH, QUALITY_THRESHOLD, Profiler
+from quantiles import QUANTILES_PATH, QuantileModel
+from recorder import RECORDING_DIR, TrajectoryRecorder
+from settle import SETTLE_VARIANCE, SETTLE_WINDOW, SettleDetector
+from simulator import PUBLISH_RATE, start_simulation
+from timeouts import (MIN_TIMEOUT, RETRY_FACTOR, TIMEOUT_FACTOR, TIMEOUT_MARGIN, TIMEOUT_SIGMA, TimeoutPolicy,
+                      is_measurement)
+from tracker import INTERPOLATION, MOVE_TIMEOUT, TIMING_MODES, CameraChannel
+
+BOLD = "\033[1m"
+RESET = "\033[0m"
+
+MOVE_DELAY = 2.0
+
+
+async def run_camera(nc, dashboard, cam_id, jobs, journal, policy, limit=1, delay=MOVE_DELAY,
+                     settle_window=SETTLE_WINDOW, settle_variance=SETTLE_VARIANCE, recorder=None,
+                     interpolation='cubic', timing='buffered', decoder=DEFAULT_DECODER, conflate=False,
+                     pending_msgs_limit=None, pending_bytes_limit=None, io=None, profile=None, quantiles=None):
+    """Walk one camera's jobs in plan order, at most `limit` moves in flight
+
+    Returns the measured execution times and the camera's channel. With an
+    IOThread, journal records are written on it instead of the loop thread.
+    """
+    write = journal.append if profile is None else profile.timed(journal.append)
+    append = write if io is None else partial(io.submit, write)
+    semaphore = asyncio.Semaphore(limit)
+    measured = []
+    channel = CameraChannel(nc, dashboard, cam_id, slots=limit,
+                            settle=SettleDetector(settle_window, settle_variance), recorder=recorder,
+                            interpolation=interpolation, timing=timing, decoder=decoder, conflate=conflate,
+                            pending_msgs_limit=pending_msgs_limit, pending_bytes_limit=pending_bytes_limit,
+                            profile=profile)
+    await channel.open()
+    await channel.wait_position()
+
+    # Every move still ahead, for the ETA: each from the previous target, the first from
+    # where the gimbal is now. Moves finish in order, so the first `finished` are done.
+    ahead = []
+    previous = None
+    for plan, index, row in jobs:
+        pan_setpoint = float(row['pan_setpoint'])
+        tilt_setpoint = float(row['tilt_setpoint'])
+        target = (pan_setpoint, -tilt_setpoint if tilt_setpoint > 0 else tilt_setpoint)
+        delta = channel.delta_to(pan_setpoint, tilt_setpoint) if previous is None else \
+            (target[0] - previous[0], target[1] - previous[1])
+        ahead.append((int(row['gimbal_speed']), *(delta or (0.0, 0.0))))
+        previous = target
+    # Wall time per move beyond its execution time: command, settling, bookkeeping
+    overhead = [0, 0.0]
+
+    def update_eta(finished):
+        predicted = policy.estimator.predict_total(cam_id, ahead[finished:])
+        if predicted is not None and overhead[0]:
+            predicted += overhead[1] / overhead[0] * (len(ahead) - finished)
+        channel.status.predict_left(predicted, time.perf_counter())
+
+    update_eta(0)
+
+    async def run_job(plan, index, row):
+        async with semaphore:
+            gimbal_speed = int(row['gimbal_speed'])
+            pan_setpoint = float(row['pan_setpoint'])
+            tilt_setpoint = float(row['tilt_setpoint'])
+            delta = channel.delta_to(pan_setpoint, tilt_setpoint)
+            if delta is None:
+                timeout = policy.ceiling
+            else:
+                timeout = policy.timeout(cam_id, gimbal_speed, *delta)
+
+            # Start the next move as soon as the gimbal is at rest; delay only caps the wait
+            started = time.perf_counter()
+            retry_timeout = policy.retry_timeout(timeout)
+            result = await channel.move(gimbal_speed, pan_setpoint, tilt_setpoint, timeout=timeout,
+                                        settle_wait=delay, tags={'plan': plan.path, 'row': index},
+                                        retry_timeout=retry_timeout)
+            execution_time = result['execution_time']
+            timeout = result['timeout']
+            if result['delta_pan'] is not None:
+                delta = result['delta_pan'], result['delta_tilt']
+            outlier = False
+            # Repositioning moves are run and journalled like any row, but are not measurements to learn from
+            learn = delta is not None and is_measurement(row)
+            if learn and execution_time is not None:
+                outlier = policy.estimator.observe(cam_id, gimbal_speed, *delta, execution_time)
+                if outlier:
+                    dashboard.event(f"Camera {cam_id}: move to pan {pan_setpoint}, tilt {tilt_setpoint} at speed "
+                                    f"{gimbal_speed} took {execution_time:.2f} s, an outlier against the "
+                                    f"current fit", cam_id=cam_id, row=index)
+                overhead[0] += 1
+                overhead[1] += time.perf_counter() - started - execution_time
+            elif learn:
+                # Slower than even the extended timeout: at least that long, which the fit should not ignore
+                policy.estimator.observe_censored(cam_id, gimbal_speed, *delta, timeout)
+            if quantiles is not None and learn:
+                # A timed-out move is censored at its timeout, so the tail it belongs to is not lost
+                quantiles.observe(cam_id, gimbal_speed, *delta, timeout if execution_time is None else execution_time,
+                                  censored=execution_time is None)
+            measured.append(execution_time)
+            update_eta(len(measured))
+            row['execution_time'] = '' if execution_time is None else execution_time
+            append({
+                'plan': plan.path,
+                'row': index,
+                'cam_id': cam_id,
+                'gimbal_speed': gimbal_speed,
+                'pan_setpoint': pan_setpoint,
+                'tilt_setpoint': tilt_setpoint,
+                **result,
+                'outlier': outlier,
+            })
+
+    try:
+        await asyncio.gather(*(run_job(plan, index, row) for plan, index, row in jobs))
+    finally:
+        await channel.close()
+    return measured, channel
+
+
+def collect_jobs(plans):
+    """Group the pending rows of every plan by camera, keeping plan order"""
+    jobs = {}
+    for plan in plans:
+        for index, row in plan.pending():
+            jobs.setdefault(int(row['cam_id']), []).append((plan, index, row))
+    return jobs
+
+
+def load_plans(specs, journal_path):
+    """Plans with every journalled result applied"""
+    plans = [Plan(plan_path(spec)) for spec in specs]
+    state = load_state(journal_path)
+    for plan in plans:
+        plan.apply(state)
+    return plans
+
+
+async def main(args):
+    # Every file and console write from here on happens off the loop thread
+    io = IOThread().start()
+    plans = await asyncio.to_thread(load_plans, args.plans, args.journal)
+    jobs = collect_jobs(plans)
+    if not jobs:
+        io.print("Nothing to do, every combination already has an execution time")
+        await io.drain()
+        io.close()
+        return
+
+    for cam_id, cam_jobs in sorted(jobs.items()):
+        io.print(f"Camera {cam_id}: {len(cam_jobs)} combinations pending")
+
+    # Predicted move times come from earlier sweeps and the rows already done in these plans
+    prior = await asyncio.to_thread(MoveModel.load, args.model) if args.model else None
+    # Move-time sketches accumulate across sweeps in the same file
+    quantiles = None
+    if args.quantiles:
+        quantiles = await asyncio.to_thread(QuantileModel.load, args.quantiles) \
+            if os.path.exists(args.quantiles) else QuantileModel()
+    policy = TimeoutPolicy(factor=args.timeout_factor, margin=args.timeout_margin,
+                           floor=args.min_timeout, ceiling=args.timeout, prior=prior,
+                           sigma=args.timeout_sigma, retry_factor=args.retry_factor)
+    policy.estimator.load_results(args.history)
+    for plan in plans:
+        policy.estimator.observe_rows(plan.rows)
+
+    cam_ids = sorted(jobs)
+    # Outliers already flagged while learning the history, not by this sweep's moves
+    known_outliers = {cam_id: policy.estimator.outliers(cam_id) for cam_id in cam_ids}
+    fleet = None
+    slow_consumers = SlowConsumerStats(log=io.print)
+    if args.simulate:
+        calibration = await asyncio.to_thread(Calibration.load, args.sim_calibration) \
+            if args.sim_calibration else None
+        nc, fleet = await start_simulation(cam_ids, rate=args.sim_rate,
+                                           encoding='binary' if args.decoder == 'binary' else 'json',
+                                           error_cb=slow_consumers.error_cb, calibration=calibration, log=io.print)
+    else:
+        nc = await connect(args.server, error_cb=slow_consumers.error_cb)
+
+    journal = Journal(args.journal)
+    recorder = TrajectoryRecorder(args.record, io=io) if args.record else None
+    dashboard = Dashboard(args.output, interval=1.0 / args.refresh, io=io)
+    for cam_id in cam_ids:
+        dashboard.camera(cam_id, total=len(jobs[cam_id]))
+    dashboard.start()
+    profiler = None
+    if args.profile:
+        profiler = Profiler(args.lag_interval, threshold=args.quality_threshold, cprofile=bool(args.cprofile))
+        monitor = profiler.start().monitor
+    else:
+        monitor = LoopLagMonitor(args.lag_interval).start()
+    start = time.perf_counter()
+    try:
+        results = await asyncio.gather(*(
+            run_camera(nc, dashboard, cam_id, jobs[cam_id], journal, policy, limit=args.per_camera,
+                       delay=args.delay,
+                       settle_window=args.settle_window, settle_variance=args.settle_variance,
+                       recorder=recorder, interpolation=args.interpolation, timing=args.timing,
+                       decoder=args.decoder, conflate=args.conflate, pending_msgs_limit=args.pending_msgs_limit,
+                       pending_bytes_limit=args.pending_bytes_limit, io=io,
+                       profile=profiler.camera(cam_id) if profiler is not None else None, quantiles=quantiles)
+            for cam_id in cam_ids
+        ))
+        elapsed = time.perf_counter() - start
+        if profiler is not None:
+            await profiler.stop()
+        await monitor.stop()
+        await dashboard.stop()
+        io.print("=" * 80)
+        for cam_id, (measured, channel) in zip(cam_ids, results):
+            timeouts = measured.count(None)
+            outliers = policy.estimator.outliers(cam_id) - known_outliers[cam_id]
+            io.print(f"Camera {cam_id}: {len(measured)} combinations, {timeouts} timeouts, "
+                     f"{outliers} outliers against the fit")
+            dropped = slow_consumers.dropped.get(f"ptzinfo.camera{cam_id}", 0)
+            if args.conflate:
+                io.print(f"Camera {cam_id}: {channel.status.samples} samples in {channel.batches} batches, "
+                         f"largest batch {channel.largest_batch}, most pending {channel.max_pending}, "
+                         f"{dropped} dropped as slow consumer")
+            elif dropped:
+                io.print(f"{BOLD}Camera {cam_id}: {dropped} messages dropped as slow consumer{RESET}")
+            if profiler is not None:
+                profile = profiler.camera(cam_id)
+                io.print(f"Camera {cam_id}: {profile.skewed} of {len(measured)} moves skewed by the harness, "
+                         f"handler p99 {(profile.handler.percentile(0.99) or 0) * 1000:.2f} ms, "
+                         f"first callback p50 {(profile.first_callback.percentile(0.5) or 0) * 1000:.1f} ms")
+            if fleet is not None and args.per_camera == 1:
+                n, bias, mae = fleet.accuracy(cam_id, measured)
+                io.print(f"Camera {cam_id}: timing error over {n} moves, "
+                         f"bias {bias * 1000:+.1f} ms, mean absolute {mae * 1000:.1f} ms")
+        dropped = slow_consumers.total()
+        if dropped:
+            io.print(f"{BOLD}{dropped} messages dropped as slow consumer over all subjects{RESET}")
+        io.print(monitor.report())
+        io.print(f"Sweep finished in {BOLD}{elapsed:.1f} Seconds{RESET}")
+    finally:
+        await monitor.stop()
+        await dashboard.stop()
+        if fleet is not None:
+            await fleet.stop()
+        await nc.drain()
+        io.submit(journal.close)
+        if recorder is not None:
+            io.submit(recorder.close)
+        if args.export:
+            io.submit(export, args.journal, args.export)
+        # Compact the journal back into the plans once, instead of after every move, and archive it
+        io.submit(compact, args.journal, [plan.path for plan in plans])
+        if profiler is not None:
+            io.submit(profiler.write, args.profile, args.cprofile)
+        if quantiles is not None:
+            io.submit(quantiles.save, args.quantiles)
+        await io.drain()
+        io.close()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Time gimbal moves for several cameras in parallel over one NATS connection")
+    parser.add_argument('plans', nargs='+',
+                        help="combination CSV files, or camera ids for camera_combinations_new_<id>.csv")
+    parser.add_argument('--server', default=NATS_URL, help="NATS server url")
+    parser.add_argument('--per-camera', type=int, default=1,
+                        help="moves allowed in flight per camera (default 1, strictly in order)")
+    parser.add_argument('--delay', type=float, default=MOVE_DELAY,
+                        help="longest pause after each move while waiting for the gimbal to settle")
+    parser.add_argument('--settle-window', type=float, default=SETTLE_WINDOW,
+                        help="seconds of telemetry the at-rest check looks back over")
+    parser.add_argument('--settle-variance', type=float, default=SETTLE_VARIANCE,
+                        help="position variance in deg^2 below which the gimbal counts as at rest")
+    parser.add_argument('--timeout', type=float, default=MOVE_TIMEOUT,
+                        help="longest wait for a move, used until a move time can be predicted")
+    parser.add_argument('--timeout-factor', type=float, default=TIMEOUT_FACTOR,
+                        help="timeout as a multiple of the predicted move time")
+    parser.add_argument('--timeout-margin', type=float, default=TIMEOUT_MARGIN,
+                        help="seconds added to the scaled predicted move time")
+    parser.add_argument('--min-timeout', type=float, default=MIN_TIMEOUT,
+                        help="shortest timeout ever used")
+    parser.add_argument('--timeout-sigma', type=float, default=TIMEOUT_SIGMA,
+                        help="standard deviations of the prediction error the timeout also covers")
+    parser.add_argument('--retry-factor', type=float, default=RETRY_FACTOR,
+                        help="a move still running at its timeout is waited for once more, up to this "
+                             "multiple of it (1 disables)")
+    parser.add_argument('--interpolation', choices=INTERPOLATION, default='cubic',
+                        help="how target-crossing instants are placed between telemetry samples")
+    parser.add_argument('--timing', choices=TIMING_MODES, default='buffered',
+                        help="start the clock when the command is queued, or flush it and start at the "
+                             "estimated server arrival (publish + half the NATS round trip)")
+    parser.add_argument('--decoder', choices=DECODERS, default=DEFAULT_DECODER,
+                        help="ptzinfo payload decoder (binary expects `simulator.py --encoding binary`)")
+    parser.add_argument('--conflate', action='store_true',
+                        help="queue raw telemetry in the callback and check it in batches with array operations")
+    parser.add_argument('--pending-msgs-limit', type=int,
+                        help="messages a ptzinfo subscription may buffer before NATS drops them (slow consumer)")
+    parser.add_argument('--pending-bytes-limit', type=int,
+                        help="bytes a ptzinfo subscription may buffer before NATS drops them (slow consumer)")
+    parser.add_argument('--loop', choices=LOOPS, default='auto',
+                        help="event loop backend (auto: uvloop when installed)")
+    parser.add_argument('--lag-interval', type=float, default=LAG_INTERVAL,
+                        help="seconds between event loop lag probes")
+    parser.add_argument('--profile', nargs='?', const=PROFILE_PATH,
+                        help=f"instrument the harness and write per-camera histograms to this JSON file "
+                             f"({PROFILE_PATH}); adds max_loop_lag, max_handler_time, first_callback_delay "
+                             f"and quality columns to every result")
+    parser.add_argument('--quality-threshold', type=float, default=QUALITY_THRESHOLD,
+                        help="loop lag or handler time in seconds above which a move's quality is 'skewed'")
+    parser.add_argument('--cprofile', help="with --profile, also write cProfile stats of the sweep to this file")
+    parser.add_argument('--history', nargs='*', default=[],
+                        help="earlier results CSVs (paths or globs) to predict move times from")
+    parser.add_argument('--model', nargs='?', const=MODEL_PATH,
+                        help=f"fitted move-time model ({MODEL_PATH}, see movemodel.py) to predict from "
+                             f"until a camera and speed have enough history")
+    parser.add_argument('--quantiles', nargs='?', const=QUANTILES_PATH,
+                        help=f"add every timed move to the move-time quantile sketches in this file "
+                             f"({QUANTILES_PATH}, see quantiles.py)")
+    parser.add_argument('--output', choices=MODES, default='live',
+                        help="live status lines, quiet, or JSON lines for headless runs")
+    parser.add_argument('--refresh', type=float, default=1.0 / REFRESH_INTERVAL,
+                        help="status refresh rate in Hz")
+    parser.add_argument('--journal', default=JOURNAL_PATH,
+                        help="append-only results journal, replayed on start to resume a sweep")
+    parser.add_argument('--export', help="also write all journalled results to a .csv/.parquet/.feather table")
+    parser.add_argument('--record', nargs='?', const=RECORDING_DIR,
+                        help=f"record every telemetry sample of every move into this directory ({RECORDING_DIR})")
+    parser.add_argument('--simulate', action='store_true',
+                        help="drive simulated gimbals on an in-process broker instead of a NATS server")
+    parser.add_argument('--sim-rate', type=float, default=PUBLISH_RATE,
+                        help="simulated telemetry rate per camera in Hz")
+    parser.add_argument('--sim-calibration',
+                        help="coefficient table from calibration.py for the simulated gimbals to move by")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    run(main(args), args.loop)
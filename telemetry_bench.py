@@ -0,0 +1,197 @@
+import argparse
+import asyncio
+import json
+import time
+
+from connection import NATS_URL, connect
+from histogram import Histogram
+from loops import LOOPS, run
+from simulator import PUBLISH_RATE, start_simulation
+
+BOLD = "\033[1m"
+RESET = "\033[0m"
+
+DURATION = 10.0
+GAP_THRESHOLD = 0.25
+
+
+def subject_for(spec):
+    """Camera ids become their ptzinfo subject, anything else is used as a subject"""
+    if spec.isdigit():
+        return f"ptzinfo.camera{spec}"
+    return spec
+
+
+def _scan_number(data, key):
+    # Read a numeric JSON field straight from the payload bytes
+    i = data.find(key)
+    if i < 0:
+        return None
+    i = data.find(b':', i + len(key))
+    j = i + 1
+    end = len(data)
+    while j < end and data[j] not in b',}':
+        j += 1
+    try:
+        return float(memoryview(data)[i + 1:j].tobytes().strip(b' "'))
+    except ValueError:
+        return None
+
+
+class SubjectStats:
+    """Arrival statistics of one telemetry subject, updated without allocating per message
+
+    Duplicates and out-of-order messages are only known from a sequence or
+    timestamp field. Byte-identical consecutive payloads are counted apart
+    as repeats, which a camera at rest sends all the time.
+    """
+    __slots__ = ['subject', 'count', 'first_arrival', 'last_arrival', 'intervals', 'gaps',
+                 'longest_gap', 'repeated', 'duplicates', 'out_of_order', 'gap_threshold', 'seq_key',
+                 '_last_payload', '_last_seq']
+
+    def __init__(self, subject, gap_threshold=GAP_THRESHOLD, seq_field=None):
+        self.subject = subject
+        self.count = 0
+        self.first_arrival = None
+        self.last_arrival = None
+        self.intervals = Histogram()
+        self.gaps = 0
+        self.longest_gap = 0.0
+        self.repeated = 0
+        self.duplicates = 0
+        self.out_of_order = 0
+        self.gap_threshold = gap_threshold
+        self.seq_key = f'"{seq_field}"'.encode() if seq_field else None
+        self._last_payload = None
+        self._last_seq = None
+
+    def on_message(self, data, now):
+        self.count += 1
+        last = self.last_arrival
+        if last is None:
+            self.first_arrival = now
+        else:
+            interval = now - last
+            self.intervals.record(interval)
+            if interval > self.gap_threshold:
+                self.gaps += 1
+                if interval > self.longest_gap:
+                    self.longest_gap = interval
+        self.last_arrival = now
+
+        if data == self._last_payload:
+            self.repeated += 1
+        self._last_payload = data
+        if self.seq_key is not None:
+            seq = _scan_number(data, self.seq_key)
+            if seq is not None and self._last_seq is not None:
+                if seq == self._last_seq:
+                    self.duplicates += 1
+                elif seq < self._last_seq:
+                    self.out_of_order += 1
+            if seq is not None:
+                self._last_seq = seq
+
+    def rate(self):
+        if self.count < 2:
+            return 0.0
+        return (self.count - 1) / (self.last_arrival - self.first_arrival)
+
+    def report(self):
+        summary = self.intervals.summary()
+        return {
+            'subject': self.subject,
+            'messages': self.count,
+            'rate': self.rate(),
+            'interval': summary,
+            'gaps': self.gaps,
+            'longest_gap': self.longest_gap,
+            'repeated': self.repeated,
+            # Unknown without a sequence field
+            'duplicates': self.duplicates if self.seq_key is not None else None,
+            'out_of_order': self.out_of_order if self.seq_key is not None else None,
+        }
+
+
+def _ms(value):
+    return '-' if value is None else f"{value * 1000:.1f}"
+
+
+def _count(value):
+    return '-' if value is None else value
+
+
+async def main(args):
+    subjects = [subject_for(spec) for spec in args.subjects]
+    fleet = None
+    if args.simulate:
+        cam_ids = [int(spec) for spec in args.subjects if spec.isdigit()]
+        nc, fleet = await start_simulation(cam_ids, rate=args.sim_rate)
+    else:
+        nc = await connect(args.server)
+
+    stats = {}
+
+    def stats_for(subject):
+        entry = stats.get(subject)
+        if entry is None:
+            entry = stats[subject] = SubjectStats(subject, args.gap, args.seq_field)
+        return entry
+
+    async def message_handler(msg):
+        stats_for(msg.subject).on_message(msg.data, time.perf_counter())
+
+    subscriptions = [await nc.subscribe(subject, cb=message_handler) for subject in subjects]
+    print(f"Listening to {', '.join(subjects)} for {args.duration:.0f} seconds...")
+    try:
+        await asyncio.sleep(args.duration)
+    finally:
+        for subscription in subscriptions:
+            await subscription.unsubscribe()
+        if fleet is not None:
+            await fleet.stop()
+        await nc.drain()
+
+    reports = [stats[subject].report() for subject in sorted(stats)]
+    print("=" * 80)
+    print(f"{'subject':<22} {'msgs':>7} {'rate Hz':>8} {'p50 ms':>7} {'p90 ms':>7} {'p99 ms':>7} "
+          f"{'max ms':>7} {'gaps':>5} {'rep':>5} {'dup':>5} {'ooo':>5}")
+    for report in reports:
+        interval = report['interval']
+        print(f"{report['subject']:<22} {report['messages']:>7} {report['rate']:>8.1f} "
+              f"{_ms(interval.get('p50')):>7} {_ms(interval.get('p90')):>7} {_ms(interval.get('p99')):>7} "
+              f"{_ms(interval.get('max')):>7} {report['gaps']:>5} {report['repeated']:>5} "
+              f"{_count(report['duplicates']):>5} {_count(report['out_of_order']):>5}")
+    missing = [subject for subject in subjects if '*' not in subject and '>' not in subject
+               and subject not in stats]
+    for subject in missing:
+        print(f"{BOLD}{subject}: no messages received{RESET}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(reports, f, indent=2)
+        print(f"Report written to {args.json}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Measure ptzinfo telemetry rate, jitter and gaps per camera")
+    parser.add_argument('subjects', nargs='+', help="camera ids or NATS subjects (wildcards allowed)")
+    parser.add_argument('--duration', type=float, default=DURATION, help="seconds to listen")
+    parser.add_argument('--gap', type=float, default=GAP_THRESHOLD,
+                        help="inter-arrival time in seconds counted as a gap")
+    parser.add_argument('--seq-field',
+                        help="payload field holding a sequence number or timestamp, for duplicate and "
+                             "order checks")
+    parser.add_argument('--json', help="also write the report to this JSON file")
+    parser.add_argument('--loop', choices=LOOPS, default='auto',
+                        help="event loop backend (auto: uvloop when installed)")
+    parser.add_argument('--server', default=NATS_URL, help="NATS server url")
+    parser.add_argument('--simulate', action='store_true',
+                        help="listen to simulated gimbals on an in-process broker")
+    parser.add_argument('--sim-rate', type=float, default=PUBLISH_RATE,
+                        help="simulated telemetry rate per camera in Hz")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    run(main(args), args.loop)
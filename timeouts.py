@@ -0,0 +1,290 @@
+import csv
+import glob
+import math
+
+from tracker import MOVE_TIMEOUT
+
+TIMEOUT_FACTOR = 1.5
+TIMEOUT_MARGIN = 1.0
+# The timeout also covers the usual error plus this many standard deviations of it
+TIMEOUT_SIGMA = 4.0
+# A move still running at its timeout is waited for once more, up to this multiple of it
+RETRY_FACTOR = 2.0
+MIN_TIMEOUT = 2.0
+MIN_SAMPLES = 5
+# Online fit: forgetting factor (a move's weight halves after about 35 later moves, so the fit
+# follows lasting changes such as a re-seated camera) and initial parameter variance
+FORGETTING = 0.98
+PRIOR_VARIANCE = 1e4
+# A move is an outlier when its error against the fit is this many standard deviations
+# from the usual error, and more than OUTLIER_FLOOR seconds
+OUTLIER_SIGMA = 4.0
+OUTLIER_FLOOR = 0.25
+# This many outliers in a row on the same side are a lasting change, which the fit restarts from
+OUTLIER_RUN = 3
+
+
+def is_measurement(row):
+    """False for plan rows only there to move the gimbal, such as the planner's repositioning moves"""
+    return row.get('purpose') in (None, '', 'measure')
+
+
+def _row_moves(rows):
+    # (row, cam_id, gimbal_speed, delta_pan, delta_tilt) of every measurement whose move is known;
+    # other rows still set where the next move starts
+    previous = {}
+    for row in rows:
+        try:
+            cam_id = int(row['cam_id'])
+            gimbal_speed = int(float(row['gimbal_speed']))
+            pan = float(row['pan_setpoint'])
+            tilt = float(row['tilt_setpoint'])
+        except (KeyError, ValueError):
+            continue
+        tilt = -tilt if tilt > 0 else tilt
+        start = previous.get(cam_id)
+        previous[cam_id] = (pan, tilt)
+        if not is_measurement(row):
+            continue
+        if row.get('delta_pan') not in (None, ''):
+            yield row, cam_id, gimbal_speed, float(row['delta_pan']), float(row['delta_tilt'])
+        elif start is not None:
+            yield row, cam_id, gimbal_speed, pan - start[0], tilt - start[1]
+
+
+def result_moves(rows, outliers=False):
+    """(cam_id, gimbal_speed, delta_pan, delta_tilt, execution_time) of every timed move in result rows
+
+    Rows that recorded their actual delta_pan/delta_tilt use it; older rows
+    take each move's start as the previous row's target. Deltas are in the
+    gimbal's frame. Rows that are not measurements (see is_measurement) or
+    were flagged as skewed by the harness are left out, and so are rows the
+    online fit flagged as outliers unless `outliers` is set.
+    """
+    for row, cam_id, gimbal_speed, delta_pan, delta_tilt in _row_moves(rows):
+        execution_time = row.get('execution_time')
+        if execution_time in (None, '') or row.get('quality') == 'skewed':
+            continue
+        if not outliers and row.get('outlier') in (True, 'True'):
+            continue
+        yield cam_id, gimbal_speed, delta_pan, delta_tilt, float(execution_time)
+
+
+def timed_out_moves(rows):
+    """(cam_id, gimbal_speed, delta_pan, delta_tilt, timeout) of every move that timed out
+
+    Only rows that recorded their timeout count: all that is known of such
+    a move is that it took longer than that.
+    """
+    for row, cam_id, gimbal_speed, delta_pan, delta_tilt in _row_moves(rows):
+        if row.get('execution_time') in (None, '') and row.get('timeout') not in (None, ''):
+            if row.get('quality') != 'skewed':
+                yield cam_id, gimbal_speed, delta_pan, delta_tilt, float(row['timeout'])
+
+
+class MoveCell:
+    """Recursive least squares of move time on [1, |delta pan|, |delta tilt|], plus residual statistics
+
+    Constant memory and time per move: the 3x3 inverse-covariance matrix is
+    updated in place, and Welford's method keeps the mean and variance of
+    each move's error against the prediction made before it was learned.
+    """
+    __slots__ = ['theta', 'p', 'n', 'residuals', 'residual_mean', 'residual_m2', 'outliers', 'run']
+
+    def __init__(self):
+        self.theta = [0.0, 0.0, 0.0]
+        self.p = [[PRIOR_VARIANCE if i == j else 0.0 for j in range(3)] for i in range(3)]
+        self.n = 0
+        self.residuals = 0
+        self.residual_mean = 0.0
+        self.residual_m2 = 0.0
+        self.outliers = 0
+        # Consecutive outliers, positive when slower than predicted
+        self.run = 0
+
+    def predict(self, pan, tilt):
+        theta = self.theta
+        return theta[0] + theta[1] * pan + theta[2] * tilt
+
+    def update(self, pan, tilt, execution_time, forgetting=FORGETTING):
+        p = self.p
+        # Without fresh information in some direction, forgetting would grow P without bound
+        if p[0][0] + p[1][1] + p[2][2] > 3 * PRIOR_VARIANCE:
+            forgetting = 1.0
+        px = [p[i][0] + p[i][1] * pan + p[i][2] * tilt for i in range(3)]
+        gain = forgetting + px[0] + px[1] * pan + px[2] * tilt
+        k = [v / gain for v in px]
+        error = execution_time - self.predict(pan, tilt)
+        for i in range(3):
+            self.theta[i] += k[i] * error
+            row = p[i]
+            for j in range(3):
+                row[j] = (row[j] - k[i] * px[j]) / forgetting
+        self.n += 1
+
+    def restart(self):
+        """Forget how certain the fit is, keeping its parameters as the starting point"""
+        self.p = [[PRIOR_VARIANCE if i == j else 0.0 for j in range(3)] for i in range(3)]
+        self.residuals = 0
+        self.residual_mean = 0.0
+        self.residual_m2 = 0.0
+        self.run = 0
+
+    def add_residual(self, residual):
+        self.residuals += 1
+        delta = residual - self.residual_mean
+        self.residual_mean += delta / self.residuals
+        self.residual_m2 += delta * (residual - self.residual_mean)
+
+    def residual_std(self):
+        return math.sqrt(self.residual_m2 / (self.residuals - 1)) if self.residuals > 1 else 0.0
+
+
+class MoveTimeEstimator:
+    """Per (camera, gimbal_speed) move-time fit, updated online after every timed move"""
+
+    def __init__(self, forgetting=FORGETTING, outlier_sigma=OUTLIER_SIGMA, outlier_floor=OUTLIER_FLOOR,
+                 outlier_run=OUTLIER_RUN):
+        self.forgetting = forgetting
+        self.outlier_sigma = outlier_sigma
+        self.outlier_floor = outlier_floor
+        self.outlier_run = outlier_run
+        self._cells = {}
+
+    def observe(self, cam_id, gimbal_speed, delta_pan, delta_tilt, execution_time):
+        """Learn one timed move; True if it was an outlier against the current fit
+
+        An outlier is learned with its error clipped to the outlier limit
+        (a Huber update), so one wild move barely moves the fit. OUTLIER_RUN
+        outliers in a row on the same side are taken as a lasting change
+        instead: the fit restarts from its current parameters and learns the
+        move in full.
+        """
+        cell = self._cells.get((cam_id, gimbal_speed))
+        if cell is None:
+            cell = self._cells[(cam_id, gimbal_speed)] = MoveCell()
+        pan = abs(delta_pan)
+        tilt = abs(delta_tilt)
+        outlier = False
+        if cell.n >= MIN_SAMPLES:
+            predicted = max(cell.predict(pan, tilt), 0.0)
+            residual = execution_time - predicted
+            if cell.residuals >= MIN_SAMPLES:
+                limit = max(self.outlier_sigma * cell.residual_std(), self.outlier_floor)
+                deviation = residual - cell.residual_mean
+                if abs(deviation) <= limit:
+                    cell.run = 0
+                else:
+                    side = 1 if deviation > 0 else -1
+                    cell.run = cell.run + side if cell.run * side > 0 else side
+                    if abs(cell.run) >= self.outlier_run:
+                        cell.restart()
+                    else:
+                        outlier = True
+                        cell.outliers += 1
+                        residual = cell.residual_mean + math.copysign(limit, deviation)
+                        execution_time = predicted + residual
+            cell.add_residual(residual)
+        cell.update(pan, tilt, execution_time, self.forgetting)
+        return outlier
+
+    def observe_censored(self, cam_id, gimbal_speed, delta_pan, delta_tilt, timeout):
+        """Learn a move that was still running after `timeout` seconds
+
+        Its time is only known to exceed the timeout, so it is learned at the
+        timeout, and only when the fit predicts less: the fit is pushed up
+        towards the slow moves it would otherwise keep cutting off.
+        """
+        cell = self._cells.get((cam_id, gimbal_speed))
+        if cell is None or cell.n < MIN_SAMPLES:
+            return
+        pan = abs(delta_pan)
+        tilt = abs(delta_tilt)
+        residual = timeout - max(cell.predict(pan, tilt), 0.0)
+        if residual > 0:
+            cell.add_residual(residual)
+            cell.update(pan, tilt, timeout, self.forgetting)
+
+    def spread(self, cam_id, gimbal_speed):
+        """(mean, standard deviation) of the fit's error in seconds, None with too little history"""
+        cell = self._cells.get((cam_id, gimbal_speed))
+        if cell is None or cell.residuals < MIN_SAMPLES:
+            return None
+        return cell.residual_mean, cell.residual_std()
+
+    def outliers(self, cam_id):
+        """Moves of one camera flagged as outliers, over all its speeds"""
+        return sum(cell.outliers for (cam, _), cell in self._cells.items() if cam == cam_id)
+
+    def samples(self, cam_id, gimbal_speed):
+        cell = self._cells.get((cam_id, gimbal_speed))
+        return cell.n if cell else 0
+
+    def predict(self, cam_id, gimbal_speed, delta_pan, delta_tilt):
+        """Expected move time in seconds, or None with too little history"""
+        cell = self._cells.get((cam_id, gimbal_speed))
+        if cell is None or cell.n < MIN_SAMPLES:
+            return None
+        return max(cell.predict(abs(delta_pan), abs(delta_tilt)), 0.0)
+
+    def predict_total(self, cam_id, moves):
+        """Expected seconds for a sequence of (gimbal_speed, delta_pan, delta_tilt), None if any is unknown"""
+        total = 0.0
+        for gimbal_speed, delta_pan, delta_tilt in moves:
+            predicted = self.predict(cam_id, gimbal_speed, delta_pan, delta_tilt)
+            if predicted is None:
+                return None
+            total += predicted
+        return total
+
+    def observe_rows(self, rows):
+        """Learn from plan-ordered result rows (see result_moves)"""
+        for cam_id, gimbal_speed, delta_pan, delta_tilt, execution_time in result_moves(rows):
+            self.observe(cam_id, gimbal_speed, delta_pan, delta_tilt, execution_time)
+
+    def load_results(self, patterns):
+        """Learn from every results CSV matching the given paths or globs"""
+        for pattern in patterns:
+            for path in sorted(glob.glob(pattern)):
+                with open(path, newline='') as csvfile:
+                    self.observe_rows(csv.DictReader(csvfile))
+
+
+class TimeoutPolicy:
+    """Move timeouts scaled from the predicted move time instead of one fixed wait
+
+    The timeout is `factor` times the prediction, or the prediction plus the
+    fit's usual error and `sigma` standard deviations of it if that is more,
+    plus `margin`. `prior` is any object with the estimator's predict() (e.g.
+    movemodel.MoveModel), consulted while this sweep has too little history
+    of its own.
+    """
+
+    def __init__(self, estimator=None, factor=TIMEOUT_FACTOR, margin=TIMEOUT_MARGIN,
+                 floor=MIN_TIMEOUT, ceiling=MOVE_TIMEOUT, prior=None, sigma=TIMEOUT_SIGMA,
+                 retry_factor=RETRY_FACTOR):
+        self.estimator = estimator or MoveTimeEstimator()
+        self.prior = prior
+        self.factor = factor
+        self.margin = margin
+        self.floor = floor
+        self.ceiling = ceiling
+        self.sigma = sigma
+        self.retry_factor = retry_factor
+
+    def timeout(self, cam_id, gimbal_speed, delta_pan, delta_tilt):
+        predicted = self.estimator.predict(cam_id, gimbal_speed, delta_pan, delta_tilt)
+        if predicted is None and self.prior is not None:
+            predicted = self.prior.predict(cam_id, gimbal_speed, delta_pan, delta_tilt)
+        if predicted is None:
+            return self.ceiling
+        timeout = self.factor * predicted
+        spread = self.estimator.spread(cam_id, gimbal_speed)
+        if spread is not None:
+            timeout = max(timeout, predicted + spread[0] + self.sigma * spread[1])
+        return min(self.ceiling, max(self.floor, timeout + self.margin))
+
+    def retry_timeout(self, timeout):
+        """Longer wait for a move still running at `timeout`, None if there is no room below the ceiling"""
+        extended = min(self.ceiling, self.retry_factor * timeout)
+        return extended if extended > timeout else None
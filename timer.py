@@ -8,12 +8,16 @@ class Timer:
     def __init__(self):
         self._start_time = None
 
-    def start(self):
-        """Start a new timer"""
+    def start(self, start_time=None):
+        """Start a new timer, optionally from an earlier perf_counter() reading"""
         if self._start_time is not None:
             raise TimerError(f"Timer is running. Use .stop() to stop it")
 
-        self._start_time = time.perf_counter()
+        self._start_time = time.perf_counter() if start_time is None else start_time
+    @property
+    def start_time(self):
+        """perf_counter() reading the running timer started at, None when stopped"""
+        return self._start_time
     def get_lapsed(self):
         if self._start_time is not None:
             elapsed_time = (time.perf_counter() - self._start_time) *1000
@@ -0,0 +1,562 @@
+import asyncio
+import json
+import math
+import time
+
+import numpy as np
+
+from decoder import DEFAULT_DECODER, decode_batch, get_decoder
+from settle import SettleDetector
+from timer import Timer
+
+POSITION_TOLERANCE = 0.1
+MOVE_TIMEOUT = 20.0
+POSITION_WAIT = 1.0
+INTERPOLATION = ('none', 'linear', 'cubic')
+# buffered: the clock starts when publish() returns, i.e. when the command is queued
+# flush:    the command is flushed and the clock starts at the estimated server
+#           arrival, half a measured round trip after it left the client
+TIMING_MODES = ('buffered', 'flush')
+
+
+def crossing_time(times, errors, count, tolerance, method='linear'):
+    """Instant a signed axis error entered the tolerance band
+
+    `times` and `errors` hold the last `count` (at most 4) samples, oldest
+    first; the newest is the first one inside tolerance. The crossing is
+    interpolated between it and the sample before, linearly or along the cubic
+    through all four samples.
+    """
+    t2 = times[count - 1]
+    if method == 'none' or count < 2:
+        return t2
+    t1 = times[count - 2]
+    e1 = errors[count - 2]
+    e2 = errors[count - 1]
+    bound = tolerance if e1 > 0 else -tolerance
+    if e1 == e2 or t2 <= t1:
+        return t2
+    crossing = t1 + (e1 - bound) / (e1 - e2) * (t2 - t1)
+    if method != 'cubic' or count < 4 or len(set(times[:4])) < 4:
+        return crossing
+
+    def cubic(t):
+        value = 0.0
+        for i in range(4):
+            term = errors[i]
+            for j in range(4):
+                if j != i:
+                    term *= (t - times[j]) / (times[i] - times[j])
+            value += term
+        return value - bound
+
+    # The cubic passes through both end samples, so the bracket holds a root
+    low, high = t1, t2
+    low_sign = e1 - bound > 0
+    for _ in range(30):
+        mid = 0.5 * (low + high)
+        if (cubic(mid) > 0) == low_sign:
+            low = mid
+        else:
+            high = mid
+    return 0.5 * (low + high)
+
+
+def _travel_time(reach_time, dead_time):
+    if reach_time is None:
+        return None
+    if dead_time is None:
+        return 0.0
+    return max(reach_time - dead_time, 0.0)
+
+
+class MoveTracker:
+    """Completion state of one move, re-armed rather than rebuilt for each combination
+
+    Besides the first-reach execution time, each sample incrementally updates
+    the latency breakdown: dead time until the first position change, per-axis
+    travel time, overshoot past the target and the time both axes last entered
+    tolerance for good (settle time). All times are seconds after the command.
+    Reach times are interpolated between samples (see crossing_time) instead of
+    being quantized to the arrival of the first sample inside tolerance.
+    """
+    __slots__ = ['tolerance', 'pan_setpoint', 'tilt_setpoint', 'pan_reached', 'tilt_reached',
+                 'armed', 'execution_time', 'timer', 'target_reached', 'start_pan', 'start_tilt',
+                 'pan_direction', 'tilt_direction', 'dead_time', 'pan_reach_time', 'tilt_reach_time',
+                 'pan_overshoot', 'tilt_overshoot', 'settle_time', 'interpolation', '_times',
+                 '_pan_errors', '_tilt_errors', '_history']
+
+    def __init__(self, tolerance=POSITION_TOLERANCE, interpolation='cubic'):
+        if interpolation not in INTERPOLATION:
+            raise ValueError(f"Unknown interpolation {interpolation!r}, expected one of {INTERPOLATION}")
+        self.tolerance = abs(tolerance)
+        self.interpolation = interpolation
+        self._times = [0.0] * 4
+        self._pan_errors = [0.0] * 4
+        self._tilt_errors = [0.0] * 4
+        self.timer = Timer()
+        self.target_reached = asyncio.Event()
+        self.arm(0.0, 0.0)
+        self.armed = False
+
+    def arm(self, pan_setpoint, tilt_setpoint):
+        self.pan_setpoint = pan_setpoint
+        self.tilt_setpoint = tilt_setpoint
+        self.pan_reached = False
+        self.tilt_reached = False
+        self.execution_time = None
+        self.start_pan = None
+        self.start_tilt = None
+        self.pan_direction = 1.0
+        self.tilt_direction = 1.0
+        self.dead_time = None
+        self.pan_reach_time = None
+        self.tilt_reach_time = None
+        self.pan_overshoot = 0.0
+        self.tilt_overshoot = 0.0
+        self.settle_time = None
+        self._history = 0
+        self.target_reached.clear()
+        self.armed = True
+
+    def disarm(self):
+        self.armed = False
+        if self.timer.start_time is not None:
+            self.timer.stop()
+
+    def shift_origin(self, origin, shift):
+        """Restart the clock at perf_counter() time `origin`, `shift` seconds after the old one"""
+        self.timer.stop()
+        self.timer.start(origin)
+        for i in range(self._history):
+            self._times[i] -= shift
+        if self.dead_time is not None:
+            self.dead_time -= shift
+        if self.pan_reach_time is not None:
+            self.pan_reach_time -= shift
+        if self.tilt_reach_time is not None:
+            self.tilt_reach_time -= shift
+        if self.settle_time is not None:
+            self.settle_time -= shift
+        if self.execution_time is not None:
+            self.execution_time = max(self.execution_time - shift, 0.0)
+
+    def _push(self, elapsed, pan_error, tilt_error):
+        times = self._times
+        pan_errors = self._pan_errors
+        tilt_errors = self._tilt_errors
+        if self._history == 4:
+            times[0], times[1], times[2] = times[1], times[2], times[3]
+            pan_errors[0], pan_errors[1], pan_errors[2] = pan_errors[1], pan_errors[2], pan_errors[3]
+            tilt_errors[0], tilt_errors[1], tilt_errors[2] = tilt_errors[1], tilt_errors[2], tilt_errors[3]
+        else:
+            self._history += 1
+        times[self._history - 1] = elapsed
+        pan_errors[self._history - 1] = pan_error
+        tilt_errors[self._history - 1] = tilt_error
+
+    def update(self, current_pan, current_tilt, now=None):
+        """Feed one telemetry sample, return the pan and tilt differences
+
+        `now` is the sample's perf_counter() arrival time, default the present.
+        """
+        if now is None:
+            elapsed = max(self.timer.get_lapsed(), 0) / 1000
+        else:
+            start = self.timer.start_time
+            elapsed = max(now - start, 0.0) if start is not None else 0.0
+        adjusted_current_tilt = -current_tilt if self.tilt_setpoint > 0 else current_tilt
+        pan_error = current_pan - self.pan_setpoint
+        tilt_error = adjusted_current_tilt - self.tilt_setpoint
+        pan_difference = abs(pan_error)
+        tilt_difference = abs(tilt_error)
+        tolerance = self.tolerance
+
+        if self.start_pan is None:
+            self.start_pan = current_pan
+            self.start_tilt = adjusted_current_tilt
+            self.pan_direction = -1.0 if pan_error > 0 else 1.0
+            self.tilt_direction = -1.0 if tilt_error > 0 else 1.0
+        elif self.dead_time is None and (abs(current_pan - self.start_pan) > tolerance
+                                         or abs(adjusted_current_tilt - self.start_tilt) > tolerance):
+            self.dead_time = elapsed
+
+        self._push(elapsed, pan_error, tilt_error)
+        times = self._times
+
+        # Positive when the axis has gone past the target in its direction of travel
+        overshoot = self.pan_direction * pan_error
+        if overshoot > self.pan_overshoot:
+            self.pan_overshoot = overshoot
+        overshoot = self.tilt_direction * tilt_error
+        if overshoot > self.tilt_overshoot:
+            self.tilt_overshoot = overshoot
+
+        if not self.pan_reached and pan_difference <= tolerance:
+            self.pan_reached = True
+            self.pan_reach_time = crossing_time(times, self._pan_errors, self._history, tolerance,
+                                                self.interpolation)
+
+        if not self.tilt_reached and tilt_difference <= tolerance:
+            self.tilt_reached = True
+            self.tilt_reach_time = crossing_time(times, self._tilt_errors, self._history, tolerance,
+                                                 self.interpolation)
+
+        if pan_difference <= tolerance and tilt_difference <= tolerance:
+            if self.settle_time is None:
+                self.settle_time = elapsed
+        else:
+            self.settle_time = None
+
+        if self.pan_reached and self.tilt_reached and not self.target_reached.is_set():
+            # Timed from the samples, not from when the waiting coroutine resumes
+            self.execution_time = max(self.pan_reach_time, self.tilt_reach_time)
+            self.target_reached.set()
+
+        return pan_difference, tilt_difference
+
+    def update_batch(self, t, pan, tilt):
+        """Feed a batch of samples as numpy arrays, return the last pan and tilt differences
+
+        `t` holds the perf_counter() arrival times. The whole batch is checked
+        with array operations; only the samples where something happens (the
+        first sample of the move, the first movement, each axis entering
+        tolerance) go through update(), with the samples before them in the
+        interpolation history, so the results match feeding every sample.
+        """
+        n = len(t)
+        start = self.timer.start_time
+        elapsed = np.maximum(t - start, 0.0) if start is not None else np.zeros(n)
+        adjusted_tilt = -tilt if self.tilt_setpoint > 0 else tilt
+        pan_error = pan - self.pan_setpoint
+        tilt_error = adjusted_tilt - self.tilt_setpoint
+        tolerance = self.tolerance
+        pan_in = np.abs(pan_error) <= tolerance
+        tilt_in = np.abs(tilt_error) <= tolerance
+        settle_time = self.settle_time
+
+        events = set()
+        if self.start_pan is None:
+            events.add(0)
+            start_pan, start_tilt = pan[0], adjusted_tilt[0]
+        else:
+            start_pan, start_tilt = self.start_pan, self.start_tilt
+        if self.dead_time is None:
+            moved = (np.abs(pan - start_pan) > tolerance) | (np.abs(adjusted_tilt - start_tilt) > tolerance)
+            if moved.any():
+                events.add(int(moved.argmax()))
+        if not self.pan_reached and pan_in.any():
+            events.add(int(pan_in.argmax()))
+        if not self.tilt_reached and tilt_in.any():
+            events.add(int(tilt_in.argmax()))
+
+        pushed = 0
+        for i in sorted(events):
+            for j in range(max(pushed, i - 3), i):
+                self._push(elapsed[j], pan_error[j], tilt_error[j])
+            self.update(pan[i], tilt[i], now=t[i])
+            pushed = i + 1
+        for j in range(max(pushed, n - 4), n):
+            self._push(elapsed[j], pan_error[j], tilt_error[j])
+
+        overshoot = (self.pan_direction * pan_error).max()
+        if overshoot > self.pan_overshoot:
+            self.pan_overshoot = float(overshoot)
+        overshoot = (self.tilt_direction * tilt_error).max()
+        if overshoot > self.tilt_overshoot:
+            self.tilt_overshoot = float(overshoot)
+
+        inside = pan_in & tilt_in
+        if not inside[-1]:
+            self.settle_time = None
+        else:
+            outside = np.flatnonzero(~inside)
+            if len(outside):
+                self.settle_time = float(elapsed[outside[-1] + 1])
+            elif settle_time is None:
+                self.settle_time = float(elapsed[0])
+            else:
+                self.settle_time = settle_time
+        return abs(pan_error[-1]), abs(tilt_error[-1])
+
+    def result(self):
+        return {
+            'execution_time': self.execution_time,
+            'dead_time': self.dead_time,
+            'pan_travel_time': _travel_time(self.pan_reach_time, self.dead_time),
+            'tilt_travel_time': _travel_time(self.tilt_reach_time, self.dead_time),
+            'pan_overshoot': self.pan_overshoot,
+            'tilt_overshoot': self.tilt_overshoot,
+            'settle_time': self.settle_time,
+        }
+
+
+class CameraChannel:
+    """One long-lived ptzinfo subscription per camera feeding reusable trackers
+
+    With `conflate`, the subscription callback only queues the raw payload
+    and its arrival time. A consumer task drains everything queued in one
+    batch, so a backlog built up while the loop was busy costs one pass of
+    array operations instead of a full handler call per stale message. Every
+    sample is still recorded and checked for completion.
+    """
+
+    def __init__(self, nc, dashboard, cam_id, slots=1, tolerance=POSITION_TOLERANCE, settle=None,
+                 recorder=None, interpolation='cubic', timing='buffered', decoder=DEFAULT_DECODER,
+                 conflate=False, pending_msgs_limit=None, pending_bytes_limit=None, profile=None):
+        if timing not in TIMING_MODES:
+            raise ValueError(f"Unknown timing mode {timing!r}, expected one of {TIMING_MODES}")
+        self.nc = nc
+        self.dashboard = dashboard
+        self.cam_id = cam_id
+        self.status = dashboard.camera(cam_id)
+        self.settle = settle or SettleDetector()
+        self.at_rest = asyncio.Event()
+        self._idle = [MoveTracker(tolerance, interpolation) for _ in range(slots)]
+        self._armed = []
+        self._subscription = None
+        self.target_pan = None
+        self.target_tilt = None
+        # Last position reported by telemetry, in the gimbal's own frame
+        self.last_pan = None
+        self.last_tilt = None
+        self.has_position = asyncio.Event()
+        self.recorder = recorder
+        self.timing = timing
+        self.decode = get_decoder(decoder)
+        self.conflate = conflate
+        self.profile = profile
+        self.pending_limits = {}
+        if pending_msgs_limit is not None:
+            self.pending_limits['pending_msgs_limit'] = pending_msgs_limit
+        if pending_bytes_limit is not None:
+            self.pending_limits['pending_bytes_limit'] = pending_bytes_limit
+        self._payloads = []
+        self._arrivals = []
+        self._wake = asyncio.Event()
+        self._consumer = None
+        self.batches = 0
+        self.largest_batch = 0
+        self.max_pending = 0
+        self._recording = recorder.buffer() if recorder is not None else None
+
+    async def open(self):
+        callback = self._enqueue if self.conflate else self._message_handler
+        if self.profile is not None:
+            callback = self.profile.wrap(callback)
+        self._subscription = await self.nc.subscribe(f"ptzinfo.camera{self.cam_id}", cb=callback,
+                                                     **self.pending_limits)
+        if self.conflate:
+            self._consumer = asyncio.create_task(self._drain_batches())
+
+    async def close(self):
+        if self._consumer is not None:
+            self._consumer.cancel()
+            self._consumer = None
+        if self._recording is not None:
+            self.recorder.write(self._recording)
+        if self._subscription is not None:
+            await self._subscription.unsubscribe()
+            self._subscription = None
+
+    def delta_to(self, pan_setpoint, tilt_setpoint):
+        """Pan and tilt travel to a target from the last reported position
+
+        Falls back to the last commanded target before any telemetry arrived,
+        and returns None before either is known.
+        """
+        adjusted_tilt = -tilt_setpoint if tilt_setpoint > 0 else tilt_setpoint
+        if self.last_pan is not None:
+            return pan_setpoint - self.last_pan, adjusted_tilt - self.last_tilt
+        if self.target_pan is not None:
+            return pan_setpoint - self.target_pan, adjusted_tilt - self.target_tilt
+        return None
+
+    async def _message_handler(self, msg):
+        status = self.status
+        try:
+            position = self.decode(msg.data)
+            if position is not None:
+                current_pan, current_tilt = position
+                self.last_pan = status.pan = current_pan
+                self.last_tilt = status.tilt = current_tilt
+                self.has_position.set()
+                status.samples += 1
+                now = time.perf_counter()
+                recording = self._recording
+                if recording is not None and recording.meta is not None:
+                    recording.append(now, current_pan, current_tilt)
+                if self.settle.update(now, current_pan, current_tilt):
+                    self.at_rest.set()
+                else:
+                    self.at_rest.clear()
+                for tracker in self._armed:
+                    status.pan_error, status.tilt_error = tracker.update(current_pan, current_tilt)
+        except ValueError:
+            status.errors += 1
+
+    async def _enqueue(self, msg):
+        self._payloads.append(msg.data)
+        self._arrivals.append(time.perf_counter())
+        self._wake.set()
+
+    async def _drain_batches(self):
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            payloads, arrivals = self._payloads, self._arrivals
+            self._payloads, self._arrivals = [], []
+            if self.profile is None:
+                self._process_batch(payloads, arrivals)
+                continue
+            # The callback only queues; the decoding happens here and is what can delay the loop
+            start = time.perf_counter()
+            self._process_batch(payloads, arrivals)
+            self.profile.handled(time.perf_counter() - start)
+
+    def _process_batch(self, payloads, arrivals):
+        status = self.status
+        self.batches += 1
+        if len(payloads) > self.largest_batch:
+            self.largest_batch = len(payloads)
+        pending = self._subscription.pending_msgs
+        if pending > self.max_pending:
+            self.max_pending = pending
+        t, pan, tilt, errors = decode_batch(self.decode, payloads, arrivals)
+        status.errors += errors
+        count = len(t)
+        if not count:
+            return
+        self.last_pan = status.pan = float(pan[-1])
+        self.last_tilt = status.tilt = float(tilt[-1])
+        self.has_position.set()
+        status.samples += count
+        recording = self._recording
+        if recording is not None and recording.meta is not None:
+            recording.extend(t, pan, tilt)
+        settle = self.settle
+        at_rest = False
+        for now, current_pan, current_tilt in zip(t.tolist(), pan.tolist(), tilt.tolist()):
+            at_rest = settle.update(now, current_pan, current_tilt)
+        if at_rest:
+            self.at_rest.set()
+        else:
+            self.at_rest.clear()
+        for tracker in self._armed:
+            status.pan_error, status.tilt_error = tracker.update_batch(t, pan, tilt)
+
+    async def move(self, gimbal_speed, pan_setpoint, tilt_setpoint, timeout=MOVE_TIMEOUT, settle_wait=0.0,
+                   tags=None, retry_timeout=None):
+        """Command one move and wait for it, returning the result columns
+
+        A move still running after `timeout` seconds is waited for once more,
+        up to `retry_timeout` seconds in all, before it counts as timed out;
+        the result's timeout is the one the move finally ran with.
+
+        After the target is reached (or the move times out) the tracker keeps
+        watching for up to `settle_wait` seconds, until the gimbal is at rest,
+        so overshoot and settle time cover the whole motion. The result also
+        holds the last reported position when the command went out, and the
+        pan/tilt delta and straight-line path length from there to the target.
+
+        With a recorder, every sample from this command until the next one is
+        recorded and indexed together with `tags` and the move's result.
+        """
+        tracker = self._idle.pop()
+        description = f"[cam {self.cam_id}] Speed {gimbal_speed}, Pan {pan_setpoint}, Tilt {tilt_setpoint}"
+
+        adjusted_tilt = -tilt_setpoint if tilt_setpoint > 0 else tilt_setpoint
+        control_msg = {
+            "pansetpoint": pan_setpoint,
+            "tiltsetpoint": adjusted_tilt,
+            "gimbal_speed": gimbal_speed
+        }
+        start_pan = self.last_pan
+        start_tilt = self.last_tilt
+        recording = self._recording
+        if recording is not None:
+            self.recorder.write(recording)
+            recording.reset({'cam_id': self.cam_id, 'gimbal_speed': gimbal_speed, 'pan_setpoint': pan_setpoint,
+                             'tilt_setpoint': tilt_setpoint, **(tags or {})})
+
+        move_profile = None
+        command = {}
+        # Everything from arming on is undone in the finally, so a failed publish cannot leak the slot
+        try:
+            tracker.arm(pan_setpoint, tilt_setpoint)
+            self._armed.append(tracker)
+            await self.nc.publish(f"ptzcontrol.camera{self.cam_id}", json.dumps(control_msg).encode())
+            origin = time.perf_counter()
+            tracker.timer.start(origin)
+            move_profile = self.profile.begin_move(origin) if self.profile is not None else None
+            if self.timing == 'flush':
+                sent = time.time()
+                await self.nc.flush()
+                rtt = time.perf_counter() - origin
+                origin += rtt / 2
+                tracker.shift_origin(origin, rtt / 2)
+                command = {'command_sent': sent, 'command_arrival': sent + rtt / 2, 'command_rtt': rtt}
+            if recording is not None:
+                recording.meta['origin'] = origin
+            self.target_pan = pan_setpoint
+            self.target_tilt = adjusted_tilt
+
+            try:
+                try:
+                    await asyncio.wait_for(tracker.target_reached.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    if retry_timeout is None or retry_timeout <= timeout:
+                        raise
+                    self.dashboard.event(f"{description}: still moving after {timeout:.1f} seconds, "
+                                         f"waiting up to {retry_timeout:.1f} seconds", cam_id=self.cam_id)
+                    wait = retry_timeout - timeout
+                    timeout = retry_timeout
+                    await asyncio.wait_for(tracker.target_reached.wait(), timeout=wait)
+                self.dashboard.event(f"{description}: target reached in {tracker.execution_time:.2f} Seconds",
+                                     cam_id=self.cam_id, execution_time=tracker.execution_time)
+            except asyncio.TimeoutError:
+                self.status.timeouts += 1
+                self.dashboard.event(f"{description}: timeout after {timeout:.1f} seconds "
+                                     f"(Pan reached: {tracker.pan_reached}, Tilt reached: {tracker.tilt_reached})",
+                                     cam_id=self.cam_id, execution_time=None)
+            await self.wait_settled(settle_wait)
+        except BaseException:
+            if move_profile is not None:
+                self.profile.abandon_move(move_profile)
+            raise
+        finally:
+            if tracker in self._armed:
+                self._armed.remove(tracker)
+            tracker.disarm()
+            self._idle.append(tracker)
+            self.status.done += 1
+        result = tracker.result()
+        result.update(command)
+        result['timeout'] = timeout
+        # Start and delta are in the gimbal's frame, the tilt being the commanded tiltsetpoint
+        if start_pan is not None:
+            delta_pan = pan_setpoint - start_pan
+            delta_tilt = adjusted_tilt - start_tilt
+            result.update(start_pan=start_pan, start_tilt=start_tilt, delta_pan=delta_pan, delta_tilt=delta_tilt,
+                          path_length=math.hypot(delta_pan, delta_tilt))
+        else:
+            result.update(start_pan=None, start_tilt=None, delta_pan=None, delta_tilt=None, path_length=None)
+        if move_profile is not None:
+            result.update(self.profile.end_move(move_profile))
+        if recording is not None and recording.meta is not None:
+            recording.meta.update(result)
+        return result
+
+    async def wait_position(self, max_wait=POSITION_WAIT):
+        """Wait for the first telemetry sample, so the first move knows where it starts"""
+        try:
+            await asyncio.wait_for(self.has_position.wait(), timeout=max_wait)
+        except asyncio.TimeoutError:
+            pass
+
+    async def wait_settled(self, max_wait):
+        """Wait until telemetry shows the gimbal at rest, for at most max_wait seconds"""
+        try:
+            await asyncio.wait_for(self.at_rest.wait(), timeout=max_wait)
+        except asyncio.TimeoutError:
+            pass